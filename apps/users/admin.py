@@ -1,10 +1,34 @@
-from django.contrib import admin
+import csv
+import itertools
+from collections import OrderedDict
+from datetime import date
+
+from django.contrib import admin, messages
+from django.contrib.admin.utils import unquote
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ERROR_FLAG, SEARCH_VAR
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import Permission, Group
+from django.core.exceptions import PermissionDenied
+from django.db.models import F
+from django.db.models.functions import Coalesce
+from django.http import HttpResponseRedirect, StreamingHttpResponse
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from django.utils.safestring import mark_safe
 from django.utils.translation import gettext_lazy as _
 
-from apps.users.forms import LedgerModelForm, UserChangeForm
+from apps.users.analytics import MAX_MONTHLY_HOURS, Z_SCORE_LIMIT, AnalyticsUnavailable, ledger_analytics
+from apps.users.documents import EXPIRING_DAYS, MAX_EXPIRING_DAYS, expiring_documents
+from apps.users.filters import AutocompleteUserFilter
+from apps.users.forms import LedgerModelForm, UserChangeForm, PayrollSelectionForm, PayrollEntryFormSet, \
+    BalanceAsOfForm, MonthlyReportForm, AnalyticsPeriodForm
 from apps.users.models import UserDocument, WorkSite, TimeSheetMonthlyRecord, Ledger, User
+from apps.users.pagination import CachedCountPaginator, KeysetChangeList
+from apps.users.payroll import payroll_initial, save_payroll
+from apps.users.reports import REPORT_MONTHS, month_totals, monthly_costs, report_months, report_rows
+from apps.users.search import SEARCH_INDEXES, full_text_search, uses_full_text_search
+from apps.users.timesheets import TimeSheetImportError, import_time_sheet
 
 from django.contrib.admin.options import flatten_fieldsets
 from django.contrib.admin.templatetags.admin_modify import register
@@ -65,12 +89,35 @@ class ReadOnlyModelAdmin(admin.ModelAdmin):
         return request.user.is_staff
 
 
-class UserDocumentAdmin(ReadOnlyModelAdmin):
+class FullTextSearchMixin:
+    """
+    Changelist search through the model's full-text index (see search.py),
+    best matches first unless a column is sorted. Where there is no index
+    the usual search_fields lookups run instead.
+    """
+
+    def get_search_results(self, request, queryset, search_term):
+        results = full_text_search(queryset, search_term)
+        if results is None:
+            return super().get_search_results(request, queryset, search_term)
+        return results, False
+
+    def get_ordering(self, request):
+        if uses_full_text_search(self.model, request.GET.get(SEARCH_VAR)):
+            return ('search_rank',)
+        return super().get_ordering(request)
+
+
+class UserDocumentAdmin(FullTextSearchMixin, ReadOnlyModelAdmin):
     list_display = ('user', 'document_type', 'name', 'description', 'issued_by', 'issued_date', 'expiry_date',
                     'image_tag')
 
     list_filter = ('user', 'document_type')
 
+    search_fields = SEARCH_INDEXES['users.userdocument']
+
+    list_select_related = ('user',)
+
     class Meta:
         model = UserDocument
 
@@ -85,6 +132,29 @@ class UserDocumentAdmin(ReadOnlyModelAdmin):
             return []
         return self.list_filter
 
+    def get_urls(self):
+        info = self.model._meta.app_label, self.model._meta.model_name
+        return [
+            path('expiring/', self.admin_site.admin_view(self.expiring_view), name='%s_%s_expiring' % info),
+        ] + super().get_urls()
+
+    def expiring_view(self, request):
+        """Documents expiring in the next days, by document type and work site."""
+        if not request.user.is_superuser:
+            raise PermissionDenied
+        try:
+            days = min(max(int(request.GET.get('days', EXPIRING_DAYS)), 0), MAX_EXPIRING_DAYS)
+        except ValueError:
+            days = EXPIRING_DAYS
+        context = dict(
+            self.admin_site.each_context(request),
+            opts=self.model._meta,
+            title=f'Documents expiring in the next {days} days',
+            days=days,
+            groups=expiring_documents(days),
+        )
+        return TemplateResponse(request, 'admin/users/userdocument/expiring.html', context)
+
 
 class EmployeeAdmin(ReadOnlyModelAdmin, UserAdmin):
     form = UserChangeForm
@@ -95,7 +165,12 @@ class EmployeeAdmin(ReadOnlyModelAdmin, UserAdmin):
         queryset = super(EmployeeAdmin, self).get_queryset(request)
         if not request.user.is_superuser:
             queryset = queryset.filter(pk=request.user.pk)
-        # queryset2 = queryset.annotate(total_expenses=Sum('user__ledgers__amount'))
+        # Totals come from the maintained EmployeeBalance row, joined in the
+        # changelist query, so each page costs the same whatever its size.
+        queryset = queryset.select_related('balance').annotate(
+            total_earning=Coalesce(F('balance__salary_total'), 0),
+            total_expenses=Coalesce(F('balance__expense_total'), 0),
+        ).annotate(current_balance=F('total_earning') - F('total_expenses'))
         return queryset
 
     add_fieldsets = (
@@ -127,6 +202,33 @@ class EmployeeAdmin(ReadOnlyModelAdmin, UserAdmin):
             return []
         return self.list_filter
 
+    def get_urls(self):
+        info = self.model._meta.app_label, self.model._meta.model_name
+        return [
+            path('<path:object_id>/balance/', self.admin_site.admin_view(self.balance_view),
+                 name='%s_%s_balance' % info),
+        ] + super().get_urls()
+
+    def balance_view(self, request, object_id):
+        """An employee's totals as of a past date, optionally as the ledger stood at a past moment."""
+        employee = self.get_object(request, unquote(object_id))
+        if employee is None:
+            return self._get_obj_does_not_exist_redirect(request, self.model._meta, object_id)
+        form = BalanceAsOfForm(request.GET or None)
+        totals = None
+        if form.is_valid():
+            totals = Ledger.user_totals_as_of(employee, **form.cleaned_data)
+
+        context = dict(
+            self.admin_site.each_context(request),
+            opts=self.model._meta,
+            original=employee,
+            title=f'Balance of {self._name(employee)}',
+            form=form,
+            totals=totals,
+        )
+        return TemplateResponse(request, 'admin/users/user/balance.html', context)
+
     def get_readonly_fields(self, request, obj=None):
         readonly_fields = list(super().get_readonly_fields(request, obj))
         if not request.user.is_superuser:
@@ -165,37 +267,240 @@ class WorkSiteAdmin(ReadOnlyModelAdmin):
         return True if request.user.is_superuser else False
 
 
-class LedgerAdmin(ReadOnlyModelAdmin):
-    list_display = ['user', 'type', 'expense_date', 'amount', 'notes', 'time_sheet_record', 'hours', 'hourly_rate',
-                    'trade']
+class Echo:
+    """File-like object whose write() hands the line back, so csv.writer can feed a generator."""
+
+    def write(self, value):
+        return value
+
+
+EXPORT_HEADER = ['id', 'username', 'employee', 'type', 'expense_date', 'amount', 'hours', 'hourly_rate', 'trade',
+                 'work_month', 'work_site', 'notes']
+
+
+def export_row(ledger):
+    record = ledger.time_sheet_record
+    return [ledger.pk, ledger.user.username, ledger.user.get_full_name(), ledger.type, ledger.expense_date,
+            ledger.amount, ledger.hours, ledger.hourly_rate, ledger.trade,
+            record.work_month if record else '', record.work_site if record and record.work_site else '',
+            ledger.notes]
+
+
+class LedgerChangeList(KeysetChangeList):
+    def get_results(self, request):
+        super().get_results(request)
+        # One query for the whole page, whatever the filters and ordering.
+        balances = Ledger.running_balances(self.result_list)
+        for ledger in self.result_list:
+            ledger.running_balance = balances.get(ledger.pk)
+
+
+class LedgerExportChangeList(LedgerChangeList):
+    """Filters, searches and orders like the changelist, without loading a page of results."""
+
+    def get_results(self, request):
+        pass
+
+
+class LedgerAdmin(FullTextSearchMixin, ReadOnlyModelAdmin):
+    list_display = ['user', 'type', 'expense_date', 'amount', '_running_balance', 'notes', 'time_sheet_record',
+                    'hours', 'hourly_rate', 'trade']
 
     list_filter = ['type', 'expense_date']
 
+    search_fields = SEARCH_INDEXES['users.ledger']
+
+    # time_sheet_record is nullable and its __str__ renders work_site, so the
+    # implicit select_related() would not follow it.
+    list_select_related = ('user', 'time_sheet_record__work_site')
+
     form = LedgerModelForm
 
+    # Default changelist order, paged by KeysetChangeList; id makes it unique.
+    keyset_ordering = ('-expense_date', 'user', 'type', 'id')
+    paginator = CachedCountPaginator
+    show_full_result_count = False
+
     class Meta:
         model = Ledger
 
+    def get_changelist(self, request, **kwargs):
+        return LedgerChangeList
+
+    def _running_balance(self, obj):
+        balance = getattr(obj, 'running_balance', None)
+        if balance is None:
+            return '-'
+        color = 'style="color: red;"' if balance < 0 else ''
+        return mark_safe(f'<span {color}>{balance:.2f}</span>')
+    _running_balance.short_description = 'Running balance'
+
     def get_queryset(self, request):
         queryset = super(LedgerAdmin, self).get_queryset(request)
         if not request.user.is_superuser:
             queryset = queryset.filter(user=request.user)
         return queryset
 
+    @property
+    def media(self):
+        return super().media + AutocompleteUserFilter.media(self.model, self.admin_site)
+
     def get_list_filter(self, request):
-        list_filter = self.list_filter
+        list_filter = list(self.list_filter)
         if request.user.is_superuser:
-            self.list_filter.append('user')
+            list_filter.append(AutocompleteUserFilter)
         return list_filter
 
-
-class MonthlySheetAdmin(ReadOnlyModelAdmin):
+    def get_urls(self):
+        info = self.model._meta.app_label, self.model._meta.model_name
+        return [
+            path('export/', self.admin_site.admin_view(self.export_view), name='%s_%s_export' % info),
+            path('payroll/', self.admin_site.admin_view(self.payroll_view), name='%s_%s_payroll' % info),
+            path('report/', self.admin_site.admin_view(self.report_view), name='%s_%s_report' % info),
+            path('analytics/', self.admin_site.admin_view(self.analytics_view), name='%s_%s_analytics' % info),
+        ] + super().get_urls()
+
+    def payroll_view(self, request):
+        """Enter a month's salaries for every employee of a work site on one screen."""
+        if not request.user.is_superuser:
+            raise PermissionDenied
+        selection = PayrollSelectionForm(request.GET or None)
+        formset = None
+        if selection.is_valid():
+            work_site = selection.cleaned_data['work_site']
+            work_month = selection.cleaned_data['work_month'].replace(day=1)
+            initial = payroll_initial(work_site, work_month)
+            if request.method == 'POST':
+                formset = PayrollEntryFormSet(request.POST, initial=initial)
+                if formset.is_valid():
+                    created, updated, deleted = save_payroll(
+                        work_site, work_month, formset.cleaned_data, history_user=request.user)
+                    self.message_user(
+                        request, f'{work_site}, {work_month:%B %Y}: {created} added, {updated} changed, '
+                                 f'{deleted} removed.', messages.SUCCESS)
+                    return HttpResponseRedirect(request.get_full_path())
+            else:
+                formset = PayrollEntryFormSet(initial=initial)
+
+        context = dict(
+            self.admin_site.each_context(request),
+            opts=self.model._meta,
+            title='Monthly payroll',
+            selection=selection,
+            formset=formset,
+        )
+        return TemplateResponse(request, 'admin/users/ledger/payroll.html', context)
+
+    def report_view(self, request):
+        """Monthly costs per work site, trade and type (or per employee), as a page or CSV."""
+        if not request.user.is_superuser:
+            raise PermissionDenied
+        form = MonthlyReportForm(request.GET or {'last_month': date.today().replace(day=1), 'months': REPORT_MONTHS})
+        months = None
+        if form.is_valid():
+            by_employee = form.cleaned_data['by_employee']
+            last_month = form.cleaned_data['last_month']
+            report = monthly_costs(report_months(last_month, form.cleaned_data['months']), by_employee=by_employee,
+                                   work_site=form.cleaned_data['work_site'])
+            if request.GET.get('format') == 'csv':
+                writer = csv.writer(Echo())
+                response = StreamingHttpResponse(
+                    (writer.writerow(row) for row in report_rows(report, by_employee)), content_type='text/csv')
+                response['Content-Disposition'] = f'attachment; filename="costs-{last_month:%Y%m}.csv"'
+                return response
+            months = [(month, rows, month_totals(rows)) for month, rows in report.items()]
+
+        query = request.GET.copy()
+        query['format'] = 'csv'
+        context = dict(
+            self.admin_site.each_context(request),
+            opts=self.model._meta,
+            title='Monthly costs',
+            form=form,
+            months=months,
+            csv_query=query.urlencode(),
+        )
+        return TemplateResponse(request, 'admin/users/ledger/report.html', context)
+
+    def analytics_view(self, request):
+        """Hourly rate and hours distributions and anomalies over the ledger."""
+        if not request.user.is_superuser:
+            raise PermissionDenied
+        form = AnalyticsPeriodForm(request.GET)
+        analytics = error = None
+        if form.is_valid():
+            try:
+                analytics = ledger_analytics(**form.cleaned_data)
+            except AnalyticsUnavailable as e:
+                error = str(e)
+
+        context = dict(
+            self.admin_site.each_context(request),
+            opts=self.model._meta,
+            title='Hours and rates analytics',
+            form=form,
+            analytics=analytics,
+            error=error,
+            z_score_limit=Z_SCORE_LIMIT,
+            max_monthly_hours=MAX_MONTHLY_HOURS,
+        )
+        return TemplateResponse(request, 'admin/users/ledger/analytics.html', context)
+
+    def export_view(self, request):
+        """Stream the filtered changelist as CSV without loading it into memory."""
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        try:
+            changelist = LedgerExportChangeList(
+                request, self.model, self.get_list_display(request), self.get_list_display_links(request, []),
+                self.get_list_filter(request), self.date_hierarchy, self.get_search_fields(request),
+                self.get_list_select_related(request), self.list_per_page, self.list_max_show_all,
+                self.list_editable, self,
+            )
+        except IncorrectLookupParameters:
+            # Like the changelist, send bad filter parameters back to it with ?e=1.
+            info = self.model._meta.app_label, self.model._meta.model_name
+            return HttpResponseRedirect(reverse('admin:%s_%s_changelist' % info) + f'?{ERROR_FLAG}=1')
+        queryset = changelist.queryset.select_related('user', 'time_sheet_record__work_site')
+
+        writer = csv.writer(Echo())
+        rows = itertools.chain([EXPORT_HEADER], (export_row(ledger) for ledger in queryset.iterator(chunk_size=2000)))
+        response = StreamingHttpResponse((writer.writerow(row) for row in rows), content_type='text/csv')
+        response['Content-Disposition'] = f'attachment; filename="ledger-{date.today():%Y%m%d}.csv"'
+        return response
+
+
+class MonthlySheetAdmin(FullTextSearchMixin, ReadOnlyModelAdmin):
 
     list_display = ['work_month', 'time_sheet_file', 'work_site', 'notes']
 
+    list_select_related = ('work_site',)
+
+    search_fields = SEARCH_INDEXES['users.timesheetmonthlyrecord']
+
+    actions = ['import_salaries']
+
     class Meta:
         model = TimeSheetMonthlyRecord
 
+    def get_actions(self, request):
+        if not request.user.is_superuser:
+            return OrderedDict()
+        actions = super().get_actions(request)
+        # Setting actions brings back the site-wide delete_selected, which this read-only admin doesn't offer.
+        actions.pop('delete_selected', None)
+        return actions
+
+    def import_salaries(self, request, queryset):
+        for record in queryset.select_related('work_site'):
+            try:
+                created = import_time_sheet(record, history_user=request.user)
+            except TimeSheetImportError as e:
+                self.message_user(request, f'{record}: {e}', messages.ERROR)
+            else:
+                self.message_user(request, f'{record}: imported {created} salary entries.', messages.SUCCESS)
+    import_salaries.short_description = 'Import salaries from the time sheet file'
+
 
 admin.site.unregister(Group)
 
@@ -0,0 +1,225 @@
+"""
+Anomaly checks over the hours and hourly rates of Ledger entries. The
+columns are read with values_list in chunks into NumPy arrays and every
+check runs over whole arrays: hourly rate and hours distributions per trade
+and per work site, rates far from their trade's median, employees booked
+for more hours in a month than MAX_MONTHLY_HOURS, and entries whose amount
+is not hours * hourly_rate.
+"""
+from itertools import islice
+
+from django.db.models import CharField
+from django.db.models.functions import Cast, Substr
+
+from apps.users.caching import cached, get_version
+from apps.users.documents import NO_SITE
+from apps.users.models import LEDGER_CACHE_TIMEOUT, LEDGER_VERSION, Ledger, User, WorkSite
+from apps.users.reports import NO_TRADE
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Modified z-score (distance from the trade median in robust standard
+# deviations) past which an hourly rate is reported.
+Z_SCORE_LIMIT = 3.5
+# 12 hours a day, 26 days a month.
+MAX_MONTHLY_HOURS = 312
+AMOUNT_TOLERANCE = 0.01
+# Anomalies listed per check; the counts cover all of them.
+LIST_LIMIT = 100
+CHUNK_SIZE = 20000
+
+COLUMNS = ('id', 'user_id', 'time_sheet_record__work_site', 'trade', 'expense_month', 'hours', 'hourly_rate',
+           'amount')
+
+
+class AnalyticsUnavailable(Exception):
+    pass
+
+
+def load_columns(entries, chunk_size=CHUNK_SIZE):
+    """
+    {column: array} of the entries that have both hours and an hourly rate,
+    fetched chunk_size rows at a time. Entries without a work site get site
+    0 and those without a trade an empty trade.
+    """
+    # The month comes back as 'YYYY-MM' text, which NumPy parses far faster
+    # than Django turns strings into dates and NumPy converts those.
+    rows = entries.filter(hours__isnull=False, hourly_rate__isnull=False).annotate(
+        expense_month=Substr(Cast('expense_date', CharField()), 1, 7),
+    ).order_by().values_list(*COLUMNS)
+    rows = rows.iterator(chunk_size=chunk_size)
+    chunks = []
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        ids, users, sites, trades, dates, hours, rates, amounts = zip(*chunk)
+        trades = np.array(trades, dtype=object)
+        trades[np.equal(trades, None)] = ''
+        chunks.append({
+            'id': np.array(ids, dtype=np.int64),
+            'user': np.array(users, dtype=np.int64),
+            'site': np.nan_to_num(np.array(sites, dtype=np.float64)).astype(np.int64),
+            'trade': trades.astype(str),
+            'month': np.array(dates, dtype='datetime64[M]'),
+            'hours': np.array(hours, dtype=np.float64),
+            'rate': np.array(rates, dtype=np.float64),
+            'amount': np.array(amounts, dtype=np.float64),
+        })
+    if not chunks:
+        return {'id': np.empty(0, np.int64), 'user': np.empty(0, np.int64), 'site': np.empty(0, np.int64),
+                'trade': np.empty(0, str), 'month': np.empty(0, 'datetime64[M]'), 'hours': np.empty(0),
+                'rate': np.empty(0), 'amount': np.empty(0)}
+    return {column: np.concatenate([chunk[column] for chunk in chunks]) for column in chunks[0]}
+
+
+def _groups(keys):
+    """(distinct keys, index of each row's key, row indices sorted by key, start of each key's run)."""
+    distinct, inverse = np.unique(keys, return_inverse=True)
+    order = np.argsort(inverse, kind='stable')
+    starts = np.searchsorted(inverse[order], np.arange(len(distinct)))
+    return distinct, inverse, order, starts
+
+
+def _describe(values):
+    p10, median, p90 = np.percentile(values, [10, 50, 90])
+    return {'mean': float(values.mean()), 'median': float(median), 'p10': float(p10), 'p90': float(p90),
+            'min': float(values.min()), 'max': float(values.max())}
+
+
+def distributions(keys, columns):
+    """{key: {'entries', 'amount', 'rate': stats, 'hours': stats}} over the rows grouped by keys."""
+    distinct, _, order, starts = _groups(keys)
+    result = {}
+    for key, rows in zip(distinct, np.split(order, starts[1:])):
+        result[key.item()] = {
+            'entries': len(rows),
+            'amount': float(columns['amount'][rows].sum()),
+            'rate': _describe(columns['rate'][rows]),
+            'hours': _describe(columns['hours'][rows]),
+        }
+    return result
+
+
+def rate_z_scores(trades, rates):
+    """
+    Modified z-score of every rate within its trade: 0.6745 * (rate - median)
+    / MAD. Falls back to the standard deviation where the MAD is 0, and is 0
+    where every rate of the trade is the same.
+    """
+    distinct, inverse, order, starts = _groups(trades)
+    medians = np.empty(len(distinct))
+    spreads = np.empty(len(distinct))
+    for index, rows in enumerate(np.split(order, starts[1:])):
+        values = rates[rows]
+        medians[index] = np.median(values)
+        mad = np.median(np.abs(values - medians[index])) / 0.6745
+        spreads[index] = mad if mad > 0 else values.std()
+    spread = spreads[inverse]
+    deviation = rates - medians[inverse]
+    return np.divide(deviation, spread, out=np.zeros_like(rates), where=spread > 0), medians[inverse]
+
+
+def monthly_hours(users, months, hours):
+    """(user ids, months, total hours, entries) per employee and month."""
+    keys = users * 100000 + months.astype(np.int64)
+    distinct, inverse = np.unique(keys, return_inverse=True)
+    totals = np.bincount(inverse, weights=hours)
+    entries = np.bincount(inverse)
+    return distinct // 100000, (distinct % 100000).astype('datetime64[M]'), totals, entries
+
+
+def analyse(entries=None, z_limit=Z_SCORE_LIMIT, max_monthly_hours=MAX_MONTHLY_HOURS,
+            tolerance=AMOUNT_TOLERANCE, limit=LIST_LIMIT):
+    """
+    Distributions and anomalies over entries (every Ledger entry when None);
+    see the module docstring. Anomaly lists hold the limit worst of each
+    kind, the counts all of them. Raises AnalyticsUnavailable without NumPy.
+    """
+    if np is None:
+        raise AnalyticsUnavailable('Ledger analytics require NumPy.')
+    columns = load_columns(Ledger.objects.all() if entries is None else entries)
+    if not len(columns['id']):
+        return {'entries': 0, 'by_trade': {}, 'by_site': {}, 'rate_outliers': [], 'rate_outlier_count': 0,
+                'hours_over_limit': [], 'hours_over_limit_count': 0, 'amount_mismatches': [],
+                'amount_mismatch_count': 0}
+
+    z_scores, medians = rate_z_scores(columns['trade'], columns['rate'])
+    outliers = np.flatnonzero(np.abs(z_scores) > z_limit)
+    outliers = outliers[np.argsort(-np.abs(z_scores[outliers]), kind='stable')]
+
+    users, months, totals, counts = monthly_hours(columns['user'], columns['month'], columns['hours'])
+    over = np.flatnonzero(totals > max_monthly_hours)
+    over = over[np.argsort(-totals[over], kind='stable')]
+
+    expected = columns['hours'] * columns['rate']
+    differences = columns['amount'] - expected
+    mismatches = np.flatnonzero(np.abs(differences) > tolerance)
+    mismatches = mismatches[np.argsort(-np.abs(differences[mismatches]), kind='stable')]
+
+    return {
+        'entries': len(columns['id']),
+        'by_trade': distributions(columns['trade'], columns),
+        'by_site': distributions(columns['site'], columns),
+        'rate_outliers': [{
+            'id': int(columns['id'][row]), 'user_id': int(columns['user'][row]), 'trade': str(columns['trade'][row]),
+            'month': columns['month'][row].item(), 'hourly_rate': float(columns['rate'][row]),
+            'trade_median': float(medians[row]), 'z_score': float(z_scores[row]),
+        } for row in outliers[:limit]],
+        'rate_outlier_count': len(outliers),
+        'hours_over_limit': [{
+            'user_id': int(users[row]), 'month': months[row].item(), 'hours': float(totals[row]),
+            'entries': int(counts[row]),
+        } for row in over[:limit]],
+        'hours_over_limit_count': len(over),
+        'amount_mismatches': [{
+            'id': int(columns['id'][row]), 'user_id': int(columns['user'][row]),
+            'month': columns['month'][row].item(), 'hours': float(columns['hours'][row]),
+            'hourly_rate': float(columns['rate'][row]), 'amount': float(columns['amount'][row]),
+            'expected': float(expected[row]), 'difference': float(differences[row]),
+        } for row in mismatches[:limit]],
+        'amount_mismatch_count': len(mismatches),
+    }
+
+
+def ledger_analytics(since=None, until=None):
+    """
+    analyse() over the entries dated from since to until (either open),
+    with trade, site and employee names filled in. Cached until the next
+    ledger change.
+    """
+    key = 'ledger-analytics:%s:%s:%s' % (
+        since and since.isoformat(), until and until.isoformat(), get_version(LEDGER_VERSION))
+    return cached('ledger analytics', key, lambda: add_names(analyse(entries_between(since, until))), LEDGER_CACHE_TIMEOUT)
+
+
+def entries_between(since=None, until=None):
+    """Ledger entries dated from since to until, both included; either may be None."""
+    entries = Ledger.objects.all()
+    if since is not None:
+        entries = entries.filter(expense_date__gte=since)
+    if until is not None:
+        entries = entries.filter(expense_date__lte=until)
+    return entries
+
+
+def add_names(result):
+    """Put work site, trade and employee names into an analyse() result."""
+    # Site names aren't unique; the id keeps two sites of the same name apart.
+    sites = {pk: f'{name} (#{pk})' for pk, name in WorkSite.objects.values_list('pk', 'name')}
+    user_ids = {row['user_id'] for kind in ('rate_outliers', 'hours_over_limit', 'amount_mismatches')
+                for row in result[kind]}
+    employees = {pk: ' '.join(filter(None, (first_name, last_name))) or username
+                 for pk, username, first_name, last_name in
+                 User.objects.filter(pk__in=user_ids).values_list('pk', 'username', 'first_name', 'last_name')}
+    result['by_trade'] = {trade or NO_TRADE: stats for trade, stats in result['by_trade'].items()}
+    result['by_site'] = {sites.get(site, NO_SITE): stats for site, stats in result['by_site'].items()}
+    for kind in ('rate_outliers', 'hours_over_limit', 'amount_mismatches'):
+        for row in result[kind]:
+            row['employee'] = employees.get(row['user_id'], row['user_id'])
+            if 'trade' in row:
+                row['trade'] = row['trade'] or NO_TRADE
+    return result
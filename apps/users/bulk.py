@@ -0,0 +1,144 @@
+from django.db import connections, router, transaction
+from django.db.models import Case, Max, Value, When
+from django.utils.timezone import now
+from simple_history.utils import get_history_manager_for_model
+
+
+def _next_primary_key(model, using):
+    connection = connections[using]
+    last_pk = model._default_manager.using(using).aggregate(last=Max('pk'))['last'] or 0
+    if connection.vendor == 'sqlite':
+        # AUTOINCREMENT never reuses ids of deleted rows, so start past the
+        # highest id ever handed out, not just the highest id still present.
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = %s', [model._meta.db_table])
+            row = cursor.fetchone()
+        if row:
+            last_pk = max(last_pk, row[0])
+    return last_pk + 1
+
+
+def _batch_size(model, objs, batch_size, using, fields=None):
+    # Django 2.0 trusts an explicit batch_size even past the backend's limit
+    # (SQLite caps a compound INSERT at 500 rows), so clamp it here.
+    fields = fields if fields is not None else list(model._meta.concrete_fields)
+    limit = max(connections[using].ops.bulk_batch_size(fields, objs), 1)
+    return min(batch_size, limit) if batch_size else limit
+
+
+def bulk_create_with_keys(objs, model, batch_size=None):
+    """
+    bulk_create that leaves every obj with its primary key set, even on
+    backends that can't report the keys they inserted (SQLite): there the
+    next free keys are assigned up front, in the inserting transaction.
+    """
+    objs = list(objs)
+    using = router.db_for_write(model)
+    with transaction.atomic(using=using, savepoint=False):
+        if not connections[using].features.can_return_ids_from_bulk_insert:
+            next_pk = _next_primary_key(model, using)
+            for obj in objs:
+                if obj.pk is None:
+                    obj.pk = next_pk
+                    next_pk += 1
+        return model._default_manager.using(using).bulk_create(
+            objs, batch_size=_batch_size(model, objs, batch_size, using))
+
+
+def bulk_history_create(objs, model, history_type='+', history_user=None, batch_size=None):
+    """
+    Write one historical record per obj with a single bulk insert per batch,
+    the same record the HistoricalRecords post_save/post_delete hooks write.
+    """
+    history_model = get_history_manager_for_model(model).model
+    history_date = now()
+    records = [
+        history_model(
+            history_date=getattr(obj, '_history_date', history_date),
+            history_type=history_type,
+            history_user=history_user,
+            history_change_reason=getattr(obj, 'changeReason', None),
+            **{field.attname: getattr(obj, field.attname)
+               for field in obj._meta.fields if field.name not in history_model._history_excluded_fields}
+        )
+        for obj in objs
+    ]
+    using = router.db_for_write(history_model)
+    return history_model._default_manager.using(using).bulk_create(
+        records, batch_size=_batch_size(history_model, records, batch_size, using))
+
+
+def bulk_create_with_history(objs, model, batch_size=None, history_user=None):
+    """
+    Bulk create objs and their historical records in one transaction.
+
+    simple_history's own helper needs the primary keys bulk_create returns,
+    which SQLite does not provide; bulk_create_with_keys assigns them up
+    front so the historical rows point at the right objects. A concurrent
+    writer taking the same ids makes the insert fail and roll back rather
+    than mislabel history.
+    """
+    objs = list(objs)
+    if not objs:
+        return objs
+    using = router.db_for_write(model)
+
+    with transaction.atomic(using=using, savepoint=False):
+        objs = bulk_create_with_keys(objs, model, batch_size)
+        bulk_history_create(objs, model, history_user=history_user, batch_size=batch_size)
+    return objs
+
+
+def bulk_update_with_history(objs, model, fields, batch_size=None, history_user=None):
+    """
+    Update fields of the saved objs with one UPDATE ... CASE statement per
+    batch (Django 2.0 has no QuerySet.bulk_update) and record the changes
+    in history. Like bulk_create, this sends no save signals.
+    """
+    objs = list(objs)
+    if not objs:
+        return 0
+    using = router.db_for_write(model)
+    model_fields = [model._meta.get_field(name) for name in fields]
+    # Each row binds two parameters per field (its When's pk and value) and
+    # one in pk__in; bulk_batch_size() only knows about inserts.
+    max_query_params = connections[using].features.max_query_params
+    limit = max(max_query_params // (2 * len(model_fields) + 1), 1) if max_query_params else len(objs)
+    batch_size = min(batch_size, limit) if batch_size else limit
+    manager = model._default_manager.using(using)
+
+    updated = 0
+    with transaction.atomic(using=using, savepoint=False):
+        for start in range(0, len(objs), batch_size):
+            batch = objs[start:start + batch_size]
+            values = {
+                field.attname: Case(
+                    *[When(pk=obj.pk, then=Value(getattr(obj, field.attname), output_field=field)) for obj in batch],
+                    output_field=field)
+                for field in model_fields
+            }
+            updated += manager.filter(pk__in=[obj.pk for obj in batch]).update(**values)
+        bulk_history_create(objs, model, history_type='~', history_user=history_user, batch_size=batch_size)
+    return updated
+
+
+def bulk_delete_with_history(objs, model, batch_size=None, history_user=None):
+    """
+    Delete the saved objs with one DELETE per batch and record the deletions
+    in history in bulk. Sends no delete signals and runs no on_delete
+    handling, so only use it for rows nothing else references.
+    """
+    objs = list(objs)
+    if not objs:
+        return 0
+    using = router.db_for_write(model)
+    batch_size = _batch_size(model, objs, batch_size, using, fields=['pk'])
+    manager = model._default_manager.using(using)
+
+    deleted = 0
+    with transaction.atomic(using=using, savepoint=False):
+        bulk_history_create(objs, model, history_type='-', history_user=history_user)
+        for start in range(0, len(objs), batch_size):
+            batch = [obj.pk for obj in objs[start:start + batch_size]]
+            deleted += manager.filter(pk__in=batch)._raw_delete(using)
+    return deleted
@@ -0,0 +1,82 @@
+"""
+Versioned cache entries: values are cached under keys that include the
+version of the data they were computed from, and changing that data bumps
+the version instead of hunting down keys. Hits and misses are counted per
+kind of entry, per process.
+"""
+import threading
+import time
+from collections import Counter
+
+from django.core.cache import cache
+
+_missing = object()
+_hits = Counter()
+_misses = Counter()
+_lock = threading.Lock()
+
+
+def _version_key(namespace):
+    return 'version:%s' % namespace
+
+
+def get_version(namespace):
+    """Current version of a namespace of cached values; part of their cache keys."""
+    key = _version_key(namespace)
+    version = cache.get(key)
+    if version is None:
+        # A fresh, time-based version can't collide with entries cached
+        # under a version that was evicted.
+        cache.add(key, int(time.time() * 1000), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(namespace):
+    """Invalidate every value cached under the namespace's current version."""
+    try:
+        cache.incr(_version_key(namespace))
+    except ValueError:
+        get_version(namespace)
+
+
+def cached(kind, key, compute, timeout=None):
+    """The value cached under key, or compute() stored there; counted under kind."""
+    value = cache.get(key, _missing)
+    with _lock:
+        (_misses if value is _missing else _hits)[kind] += 1
+    if value is _missing:
+        value = compute()
+        cache.set(key, value, timeout)
+    return value
+
+
+def cached_many(kind, keys, compute, timeout=None):
+    """
+    {name: value} for keys, a {name: cache key} mapping: the cached values,
+    read in one get_many(), plus compute(missing names) -> {name: value} for
+    the rest, which are stored. Counted under kind, one per key.
+    """
+    found = cache.get_many(list(keys.values()))
+    values = {name: found[key] for name, key in keys.items() if key in found}
+    missing = [name for name in keys if name not in values]
+    with _lock:
+        _hits[kind] += len(values)
+        _misses[kind] += len(missing)
+    if missing:
+        computed = compute(missing)
+        cache.set_many({keys[name]: computed[name] for name in missing}, timeout)
+        values.update(computed)
+    return values
+
+
+def cache_stats():
+    with _lock:
+        kinds = sorted(set(_hits) | set(_misses))
+        return {kind: {'hits': _hits[kind], 'misses': _misses[kind]} for kind in kinds}
+
+
+def reset_cache_stats():
+    with _lock:
+        _hits.clear()
+        _misses.clear()
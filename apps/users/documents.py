@@ -0,0 +1,51 @@
+from collections import OrderedDict
+from datetime import date, timedelta
+
+from django.core.cache import cache
+from django.db.models import OuterRef, Subquery
+
+from apps.users.caching import get_version
+from apps.users.models import Ledger, UserDocument
+
+EXPIRING_DAYS = 30
+# Longest window the expiring documents page accepts.
+MAX_EXPIRING_DAYS = 3650
+NO_SITE = 'No work site'
+
+
+def expiring_documents(days, today=None):
+    """
+    Documents whose expiry_date falls within the next days days, grouped as
+    {(document type, work site): [document values, ...]}.
+
+    One indexed range query; the employee's work site is the site of their
+    latest time sheet entry. Cached until the next document change.
+    """
+    today = today or date.today()
+    key = 'documents:expiring:%s:%s:%d' % (get_version('documents'), today.isoformat(), days)
+    groups = cache.get(key)
+    if groups is None:
+        groups = _group_documents(_query_expiring(today, today + timedelta(days=days)))
+        cache.set(key, groups, 24 * 60 * 60)
+    return groups
+
+
+def _query_expiring(start, end):
+    latest_site = Ledger.objects.filter(
+        user=OuterRef('user'), time_sheet_record__work_site__isnull=False,
+    ).order_by('-expense_date', '-id').values('time_sheet_record__work_site__name')[:1]
+    return UserDocument.objects.filter(expiry_date__range=(start, end)).annotate(
+        work_site=Subquery(latest_site),
+    ).values(
+        'id', 'user_id', 'user__username', 'user__first_name', 'user__last_name', 'document_type', 'name',
+        'expiry_date', 'work_site',
+    ).order_by('document_type', 'expiry_date')
+
+
+def _group_documents(rows):
+    groups = OrderedDict()
+    for row in rows:
+        row['employee'] = ' '.join(filter(None, (row['user__first_name'], row['user__last_name']))) or \
+            row['user__username']
+        groups.setdefault((row['document_type'], row['work_site'] or NO_SITE), []).append(row)
+    return OrderedDict(sorted(groups.items()))
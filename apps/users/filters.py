@@ -0,0 +1,60 @@
+from django import forms
+from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.exceptions import ValidationError
+from django.urls import reverse
+from django.utils.translation import gettext_lazy as _
+
+
+class AutocompleteUserFilter(admin.ListFilter):
+    """
+    Sidebar filter on the ``user`` foreign key that searches employees through
+    the Employee admin's autocomplete view instead of listing every user.
+    The Employee admin must define search_fields.
+    """
+    title = _('employee')
+    field_name = 'user'
+    template = 'admin/users/autocomplete_list_filter.html'
+
+    def __init__(self, request, params, model, model_admin):
+        super().__init__(request, params, model, model_admin)
+        self.field = model._meta.get_field(self.field_name)
+        self.parameter_name = '%s__%s__exact' % (self.field_name, self.field.target_field.name)
+        self.value = params.pop(self.parameter_name, None)
+        self.admin_site = model_admin.admin_site
+        self.selected = None
+        if self.value:
+            try:
+                self.selected = self.field.related_model._default_manager.filter(pk=self.value).first()
+            except (ValueError, ValidationError) as e:
+                raise IncorrectLookupParameters(e)
+
+    @classmethod
+    def media(cls, model, admin_site):
+        """Assets for the select2 widget; add them to the ModelAdmin's media."""
+        rel = model._meta.get_field(cls.field_name).remote_field
+        return AutocompleteSelect(rel, admin_site).media + forms.Media(js=('users/js/autocomplete_list_filter.js',))
+
+    @property
+    def autocomplete_url(self):
+        opts = self.field.related_model._meta
+        return reverse('%s:%s_%s_autocomplete' % (self.admin_site.name, opts.app_label, opts.model_name))
+
+    def has_output(self):
+        return True
+
+    def expected_parameters(self):
+        return [self.parameter_name]
+
+    def choices(self, changelist):
+        yield {
+            'selected': self.value is None,
+            'query_string': changelist.get_query_string(remove=[self.parameter_name]),
+            'display': _('All'),
+        }
+
+    def queryset(self, request, queryset):
+        if self.value:
+            return queryset.filter(**{self.parameter_name: self.value})
+        return queryset
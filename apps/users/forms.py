@@ -1,11 +1,14 @@
 import datetime
 
 from django.contrib.auth import forms
-from django.forms import ModelForm, DateField, Form, FileField
+from django.core.exceptions import ValidationError
+from django.forms import ModelForm, DateField, Form, FileField, ModelChoiceField, IntegerField, FloatField, \
+    CharField, HiddenInput, formset_factory, DateTimeField, BooleanField
 from django.contrib.auth.forms import UserChangeForm as BaseUserChangeForm
 from django.contrib.auth.forms import UserCreationForm as BaseUserCreationForm
 
-from apps.users.models import Ledger
+from apps.users.models import Ledger, WorkSite
+from apps.users.reports import REPORT_MONTHS
 from apps.users.widgets import MonthYearWidget
 
 
@@ -26,3 +29,44 @@ class UserChangeForm(BaseUserChangeForm):
     def __init__(self, *args, **kwargs):
         super(UserChangeForm, self).__init__(*args, **kwargs)
         self.fields['profile_pic'] = FileField(label="Profile Picture")
+
+
+class PayrollSelectionForm(Form):
+    work_site = ModelChoiceField(queryset=WorkSite.objects.all())
+    work_month = DateField(widget=MonthYearWidget())
+
+
+class PayrollEntryForm(Form):
+    user_id = IntegerField(widget=HiddenInput)
+    hours = FloatField(required=False, min_value=0)
+    hourly_rate = FloatField(required=False, min_value=0)
+    trade = CharField(required=False, max_length=255)
+    notes = CharField(required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if (cleaned_data.get('hours') is None) != (cleaned_data.get('hourly_rate') is None):
+            raise ValidationError('Enter both hours and hourly rate, or neither.')
+        return cleaned_data
+
+
+PayrollEntryFormSet = formset_factory(PayrollEntryForm, extra=0)
+
+
+class BalanceAsOfForm(Form):
+    as_of = DateField(required=False, label='Entries dated up to',
+                      help_text='YYYY-MM-DD. Leave empty to count every entry.')
+    recorded_at = DateTimeField(required=False, label='As recorded at',
+                                help_text='YYYY-MM-DD HH:MM. Leave empty for the ledger as it is now.')
+
+
+class MonthlyReportForm(Form):
+    last_month = DateField(widget=MonthYearWidget(), label='Up to')
+    months = IntegerField(min_value=1, max_value=120, initial=REPORT_MONTHS)
+    work_site = ModelChoiceField(queryset=WorkSite.objects.all(), required=False, empty_label='All work sites')
+    by_employee = BooleanField(required=False, label='Per employee')
+
+
+class AnalyticsPeriodForm(Form):
+    since = DateField(required=False, label='Entries dated from', help_text='YYYY-MM-DD. Leave empty for all.')
+    until = DateField(required=False, label='to', help_text='YYYY-MM-DD. Leave empty for all.')
@@ -0,0 +1,43 @@
+"""
+Retention for HistoricalLedger, which gains a full row copy on every save.
+
+Compacting history before a cut-off keeps, for every ledger entry, only the
+last version recorded before it, so "as recorded at" questions from the
+cut-off onwards get the same answers. Every older version, and the whole
+history of entries deleted before the cut-off, is moved to
+LedgerHistoryArchive (or dropped).
+"""
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+
+from apps.users.models import Ledger, LedgerHistoryArchive
+
+
+def superseded_history(before):
+    """HistoricalLedger rows recorded before `before` that compaction removes."""
+    history = Ledger.history.model.objects
+    later = history.filter(id=OuterRef('id'), history_date__lt=before).filter(
+        Q(history_date__gt=OuterRef('history_date')) |
+        Q(history_date=OuterRef('history_date'), history_id__gt=OuterRef('history_id')))
+    deleted = history.filter(id=OuterRef('id'), history_date__lt=before, history_type='-')
+    return history.filter(history_date__lt=before).annotate(
+        superseded=Exists(later), deleted=Exists(deleted),
+    ).filter(Q(superseded=True) | Q(deleted=True))
+
+
+def compact_ledger_history(before, archive=True, batch_size=500):
+    """
+    Move (or with archive=False, delete) the superseded history before
+    `before`, batch_size rows per transaction. Returns the number of rows.
+    """
+    history = Ledger.history.model.objects
+    history_ids = list(superseded_history(before).order_by('history_id').values_list('history_id', flat=True))
+    fields = [field.attname for field in LedgerHistoryArchive._meta.concrete_fields]
+    for start in range(0, len(history_ids), batch_size):
+        batch = history.filter(history_id__in=history_ids[start:start + batch_size])
+        with transaction.atomic():
+            if archive:
+                LedgerHistoryArchive.objects.bulk_create(
+                    [LedgerHistoryArchive(**row) for row in batch.values(*fields)])
+            batch.delete()
+    return len(history_ids)
@@ -0,0 +1,134 @@
+import json
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment, \
+    teardown_test_environment
+from django.urls import reverse
+
+from apps.users.models import ExpenseTypes, Ledger, User
+from apps.users.seeding import seed
+
+PERCENTILES = (50, 90, 99)
+CHANGELISTS = (
+    ('employee changelist', 'admin:users_user_changelist'),
+    ('ledger changelist', 'admin:users_ledger_changelist'),
+    ('document changelist', 'admin:users_userdocument_changelist'),
+    ('timesheet changelist', 'admin:users_timesheetmonthlyrecord_changelist'),
+)
+
+
+def benchmark_caches(size):
+    # A cache per size (LocMemCache stores are shared per LOCATION), so counts
+    # cached at one size don't leak into the next.
+    return {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': f'benchmark-{size}'}}
+
+
+def percentile(samples, percent):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered)) - 1))]
+
+
+class Command(BaseCommand):
+    help = ('Seed a throwaway test database at each size and time the admin changelists and per-employee totals. '
+            'Reports latency percentiles and query counts, and fails on regressions against a saved baseline.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='100,1000', help='Comma separated employee counts to benchmark.')
+        parser.add_argument('--sites-per', type=int, default=50, help='Employees per work site.')
+        parser.add_argument('--years', type=int, default=2)
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per target, after one warm-up.')
+        parser.add_argument('--baseline', help='JSON file of earlier results to compare against.')
+        parser.add_argument('--save-baseline', help='Write the results to this JSON file.')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed median slowdown against the baseline, as a fraction.')
+        parser.add_argument('--min-slowdown-ms', type=float, default=5.0,
+                            help='Median slowdowns smaller than this are treated as noise.')
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+
+        results = {}
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            for size in sizes:
+                with override_settings(CACHES=benchmark_caches(size)):
+                    results[str(size)] = self.run_size(size, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+            self.stdout.write(f"Saved results to {options['save_baseline']}.")
+        if baseline is not None:
+            self.compare(results, baseline, options['tolerance'], options['min_slowdown_ms'])
+
+    def run_size(self, size, options):
+        call_command('flush', verbosity=0, interactive=False)
+        start = time.perf_counter()
+        seed(size, max(size // options['sites_per'], 1), years=options['years'])
+        self.stdout.write(f'\n{size} employees (seeded in {time.perf_counter() - start:.1f}s)')
+
+        admin_user = User.objects.create_superuser('benchmark', 'benchmark@example.com', None)
+        client = Client()
+        client.force_login(admin_user)
+        employee = User.objects.filter(is_superuser=False).order_by('pk')[size // 2]
+
+        targets = [(label, self.get_page(client, reverse(url_name))) for label, url_name in CHANGELISTS]
+        targets.append(('user total aggregate',
+                        lambda: Ledger.user_total_expenses_or_earning(employee, ExpenseTypes.SALARY.name)))
+
+        results = {}
+        for label, target in targets:
+            target()
+            timings, queries = [], 0
+            for _ in range(options['repeat']):
+                with CaptureQueriesContext(connection) as context:
+                    start = time.perf_counter()
+                    target()
+                    timings.append((time.perf_counter() - start) * 1000)
+                queries = max(queries, len(context.captured_queries))
+            result = {f'p{percent}': round(percentile(timings, percent), 2) for percent in PERCENTILES}
+            result['queries'] = queries
+            results[label] = result
+            self.stdout.write(f"  {label:<32}" + ''.join(f"p{percent} {result[f'p{percent}']:>8.2f} ms  "
+                                                          for percent in PERCENTILES) + f'{queries:>3} queries')
+        return results
+
+    @staticmethod
+    def get_page(client, url):
+        def get():
+            response = client.get(url)
+            if response.status_code != 200:
+                raise CommandError(f'GET {url} returned {response.status_code}.')
+        return get
+
+    def compare(self, results, baseline, tolerance, min_slowdown_ms):
+        regressions = []
+        for size, targets in results.items():
+            for label, result in targets.items():
+                before = baseline.get(size, {}).get(label)
+                if before is None:
+                    continue
+                if result['queries'] > before['queries']:
+                    regressions.append(f"{size} employees, {label}: {before['queries']} -> {result['queries']} queries")
+                slowdown = result['p50'] - before['p50']
+                if slowdown > min_slowdown_ms and slowdown > before['p50'] * tolerance:
+                    regressions.append(f"{size} employees, {label}: median {before['p50']:.2f} -> "
+                                       f"{result['p50']:.2f} ms")
+        for regression in regressions:
+            self.stderr.write(regression)
+        if regressions:
+            raise CommandError(f'{len(regressions)} regressions against the baseline.')
+        self.stdout.write(self.style.SUCCESS('No regressions against the baseline.'))
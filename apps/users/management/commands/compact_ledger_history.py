@@ -0,0 +1,28 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.users.history import compact_ledger_history, superseded_history
+
+
+class Command(BaseCommand):
+    help = ('Move ledger history older than the retention period to the archive table, keeping the last '
+            'version of each entry from before the cut-off.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.LEDGER_HISTORY_RETENTION_DAYS,
+                            help='Keep every version recorded in the last this many days.')
+        parser.add_argument('--delete', action='store_true', help='Delete the old versions instead of archiving.')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the versions that would go.')
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options['days'])
+        if options['dry_run']:
+            count = superseded_history(before).count()
+            self.stdout.write(f'{count} history rows from before {before:%Y-%m-%d} would be compacted.')
+            return
+        count = compact_ledger_history(before, archive=not options['delete'])
+        action = 'Deleted' if options['delete'] else 'Archived'
+        self.stdout.write(self.style.SUCCESS(f'{action} {count} history rows from before {before:%Y-%m-%d}.'))
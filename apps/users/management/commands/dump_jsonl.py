@@ -0,0 +1,28 @@
+import gzip
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.users.transfer import dump
+
+
+class Command(BaseCommand):
+    help = ('Stream employees, work sites, documents, time sheets, ledger entries and ledger history to a JSONL '
+            'file (gzipped if it ends in .gz) for load_jsonl.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Output file, or - for standard output.')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        path = options['path']
+        if path == '-':
+            counts = dump(sys.stdout, options['chunk_size'])
+        else:
+            opener = gzip.open if path.endswith('.gz') else open
+            with opener(path, 'wt', encoding='utf-8') as stream:
+                counts = dump(stream, options['chunk_size'])
+        summary = ', '.join(f'{count} {label}' for label, count in counts.items())
+        self.stderr.write(f'Dumped {summary} in {time.perf_counter() - start:.1f}s.')
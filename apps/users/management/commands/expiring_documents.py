@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from apps.users.documents import EXPIRING_DAYS, expiring_documents
+
+
+class Command(BaseCommand):
+    help = 'Print a digest of the documents expiring soon, by document type and work site (e.g. from a nightly cron).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=EXPIRING_DAYS,
+                            help='How many days ahead to look.')
+
+    def handle(self, *args, **options):
+        days = options['days']
+        groups = expiring_documents(days)
+        if not groups:
+            self.stdout.write(f'No documents expire in the next {days} days.')
+            return
+        total = sum(len(documents) for documents in groups.values())
+        self.stdout.write(f'{total} documents expire in the next {days} days.')
+        for (document_type, work_site), documents in groups.items():
+            self.stdout.write(f'\n{document_type} - {work_site} ({len(documents)})')
+            for document in documents:
+                self.stdout.write(f'  {document["expiry_date"]}  {document["employee"]}: {document["name"]}')
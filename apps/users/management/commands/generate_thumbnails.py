@@ -0,0 +1,44 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.users import thumbnails
+from apps.users.models import THUMBNAIL_FIELDS
+
+
+class Command(BaseCommand):
+    help = 'Create missing thumbnails for existing profile pictures and document images.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Re-render thumbnails that already exist.')
+        parser.add_argument('--workers', type=int, default=settings.THUMBNAIL_WORKERS or 1)
+
+    def handle(self, *args, **options):
+        if thumbnails.Image is None:
+            raise CommandError('Pillow is required to render thumbnails.')
+
+        jobs = {}
+        for model, field_names in THUMBNAIL_FIELDS.items():
+            for field_name in field_names:
+                names = model._default_manager.exclude(**{field_name: ''}).values_list(field_name, flat=True)
+                for name in names.iterator():
+                    target = thumbnails.thumbnail_name(name)
+                    if name in jobs or (not options['force'] and default_storage.exists(target)):
+                        continue
+                    if not default_storage.exists(name):
+                        self.stderr.write(f'Missing file: {name}')
+                        continue
+                    jobs[name] = (default_storage.path(name), default_storage.path(target))
+
+        created = failed = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            futures = {executor.submit(thumbnails.render_thumbnail, *paths): name for name, paths in jobs.items()}
+            for future in as_completed(futures):
+                if future.exception() is None:
+                    created += 1
+                else:
+                    failed += 1
+                    self.stderr.write(f'{futures[future]}: {future.exception()}')
+        self.stdout.write(self.style.SUCCESS(f'Created {created} thumbnails, {failed} failed.'))
@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from apps.users import analytics
+from apps.users.analytics import AnalyticsUnavailable
+
+
+def date_argument(value):
+    parsed = parse_date(value)
+    if parsed is None:
+        raise ValueError(value)
+    return parsed
+
+
+class Command(BaseCommand):
+    help = ('Print hourly rate and hours distributions per trade and per work site, and the entries with outlying '
+            'rates, excessive monthly hours or an amount that is not hours * hourly rate.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=date_argument, help='Only entries dated on or after YYYY-MM-DD.')
+        parser.add_argument('--until', type=date_argument, help='Only entries dated on or before YYYY-MM-DD.')
+        parser.add_argument('--z-score', type=float, default=analytics.Z_SCORE_LIMIT,
+                            help='Report hourly rates more than this many deviations from their trade median.')
+        parser.add_argument('--max-monthly-hours', type=float, default=analytics.MAX_MONTHLY_HOURS)
+        parser.add_argument('--tolerance', type=float, default=analytics.AMOUNT_TOLERANCE,
+                            help='Largest difference tolerated between amount and hours * hourly rate.')
+        parser.add_argument('--limit', type=int, default=analytics.LIST_LIMIT, help='Entries listed per check.')
+
+    def handle(self, *args, **options):
+        try:
+            result = analytics.add_names(analytics.analyse(
+                analytics.entries_between(options['since'], options['until']), z_limit=options['z_score'],
+                max_monthly_hours=options['max_monthly_hours'], tolerance=options['tolerance'],
+                limit=options['limit']))
+        except AnalyticsUnavailable as e:
+            raise CommandError(e)
+
+        self.stdout.write(f"{result['entries']} entries with hours and an hourly rate.")
+        for heading, groups in (('trade', result['by_trade']), ('work site', result['by_site'])):
+            self.stdout.write(f'\nBy {heading}:')
+            for key, stats in groups.items():
+                rate, hours = stats['rate'], stats['hours']
+                self.stdout.write(
+                    f"  {key}: {stats['entries']} entries, {stats['amount']:.2f} paid; "
+                    f"rate median {rate['median']:.2f} (p10 {rate['p10']:.2f}, p90 {rate['p90']:.2f}); "
+                    f"hours median {hours['median']:.1f} (p10 {hours['p10']:.1f}, p90 {hours['p90']:.1f})")
+
+        self.stdout.write(f"\n{result['rate_outlier_count']} outlying hourly rates:")
+        for row in result['rate_outliers']:
+            self.stdout.write(
+                f"  #{row['id']} {row['employee']} {row['month']:%Y-%m} {row['trade']}: {row['hourly_rate']:.2f} "
+                f"against a median of {row['trade_median']:.2f} (z {row['z_score']:.1f})")
+        self.stdout.write(f"\n{result['hours_over_limit_count']} employee months over "
+                          f"{options['max_monthly_hours']:g} hours:")
+        for row in result['hours_over_limit']:
+            self.stdout.write(f"  {row['employee']} {row['month']:%Y-%m}: {row['hours']:.1f} hours "
+                              f"in {row['entries']} entries")
+        self.stdout.write(f"\n{result['amount_mismatch_count']} amounts that are not hours * hourly rate:")
+        for row in result['amount_mismatches']:
+            self.stdout.write(
+                f"  #{row['id']} {row['employee']} {row['month']:%Y-%m}: {row['amount']:.2f}, expected "
+                f"{row['hours']:g} * {row['hourly_rate']:.2f} = {row['expected']:.2f}")
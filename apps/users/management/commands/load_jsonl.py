@@ -0,0 +1,31 @@
+import gzip
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.users.transfer import LoadError, load
+
+
+class Command(BaseCommand):
+    help = ('Bulk load a dump_jsonl file into an empty, migrated database, without save signals or history '
+            'records, then reset sequences and rebuild employee balances.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Input file (gzipped if it ends in .gz), or - for standard input.')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per INSERT executemany() call.')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        path = options['path']
+        try:
+            if path == '-':
+                counts = load(sys.stdin, options['batch_size'])
+            else:
+                opener = gzip.open if path.endswith('.gz') else open
+                with opener(path, 'rt', encoding='utf-8') as stream:
+                    counts = load(stream, options['batch_size'])
+        except LoadError as e:
+            raise CommandError(e)
+        summary = ', '.join(f'{count} {label}' for label, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f'Loaded {summary} in {time.perf_counter() - start:.1f}s.'))
@@ -0,0 +1,114 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, connections, transaction
+
+from apps.users.models import ExpenseTypes, Ledger, User
+from apps.users.seeding import seed
+
+# What SQLite gives without the tuned settings: rollback journal (set once
+# per run, since changing it needs the only connection), full sync, default
+# caches, plain BEGIN and a 5 second busy timeout.
+STOCK_OPTIONS = {
+    'timeout': 5,
+    'init_command': 'PRAGMA synchronous = FULL',
+}
+
+
+class Command(BaseCommand):
+    help = ('Measure ledger write throughput with concurrent writers (and readers) on a throwaway copy of the '
+            'schema. On SQLite, runs once with stock settings and once with the configured ones.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=4)
+        parser.add_argument('--readers', type=int, default=2)
+        parser.add_argument('--seconds', type=float, default=5.0, help='Duration of each run.')
+        parser.add_argument('--employees', type=int, default=200)
+
+    def handle(self, *args, **options):
+        test_settings = connection.settings_dict.setdefault('TEST', {})
+        old_test_name = test_settings.get('NAME')
+        directory = tempfile.mkdtemp()
+        if connection.vendor == 'sqlite':
+            # A file, not the default in-memory test database, so connections
+            # contend the way separate worker processes do.
+            test_settings['NAME'] = os.path.join(directory, 'load_test.sqlite3')
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            seed(options['employees'], max(options['employees'] // 50, 1), years=1)
+            user_ids = list(User.objects.values_list('pk', flat=True))
+            runs = [('configured', None)]
+            if connection.vendor == 'sqlite':
+                runs.insert(0, ('stock', STOCK_OPTIONS))
+            for label, database_options in runs:
+                self.report(label, self.run(user_ids, database_options, options))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            test_settings['NAME'] = old_test_name
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def run(self, user_ids, database_options, options):
+        stats = {'writes': 0, 'reads': 0, 'locked': 0, 'max_write_ms': 0.0}
+        lock = threading.Lock()
+        connection.close()
+        if database_options is not None:
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode = DELETE')
+        else:
+            # A new connection applies the configured settings, WAL included.
+            connection.ensure_connection()
+        connection.close()
+        deadline = time.perf_counter() + options['seconds']
+
+        def worker(index, write):
+            if database_options is not None:
+                connections['default'].settings_dict = dict(
+                    connections['default'].settings_dict, OPTIONS=database_options)
+            try:
+                while time.perf_counter() < deadline:
+                    start = time.perf_counter()
+                    try:
+                        if write:
+                            self.write(user_ids[(index + stats['writes']) % len(user_ids)])
+                        else:
+                            list(Ledger.objects.select_related('user')[:100])
+                    except OperationalError:
+                        with lock:
+                            stats['locked'] += 1
+                        continue
+                    elapsed = (time.perf_counter() - start) * 1000
+                    with lock:
+                        stats['writes' if write else 'reads'] += 1
+                        if write:
+                            stats['max_write_ms'] = max(stats['max_write_ms'], elapsed)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker, args=(i, True)) for i in range(options['writers'])]
+        threads += [threading.Thread(target=worker, args=(i, False)) for i in range(options['readers'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats['seconds'] = options['seconds']
+        return stats
+
+    @staticmethod
+    def write(user_id):
+        # The same work as saving a ledger entry in the admin: the row, its
+        # history record and the EmployeeBalance update, in one transaction.
+        with transaction.atomic():
+            Ledger.objects.create(user_id=user_id, type=ExpenseTypes.EXPENSE_ADVANCE.name,
+                                  expense_date=date.today(), amount=10, notes='Load test')
+
+    def report(self, label, stats):
+        self.stdout.write(
+            f"{label:>10}: {stats['writes'] / stats['seconds']:8.1f} writes/s, "
+            f"{stats['reads'] / stats['seconds']:8.1f} reads/s, {stats['locked']} locked errors, "
+            f"slowest write {stats['max_write_ms']:.0f} ms")
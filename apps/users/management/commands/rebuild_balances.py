@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.users.models import EmployeeBalance
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the EmployeeBalance summary table from Ledger, or check it against a full recompute.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Compare the stored balances with a full recompute without changing them.')
+        parser.add_argument('--tolerance', type=float, default=0.005,
+                            help='Largest difference tolerated between stored and recomputed totals.')
+
+    def handle(self, *args, **options):
+        if options['check']:
+            self.check_balances(options['tolerance'])
+            return
+        count = EmployeeBalance.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt balances for {count} employees.'))
+
+    def check_balances(self, tolerance):
+        expected = EmployeeBalance.compute_totals()
+        stored = {balance.user_id: balance for balance in EmployeeBalance.objects.all()}
+        mismatches = []
+        for user_id in set(expected) | set(stored):
+            totals = expected.get(user_id, {})
+            balance = stored.get(user_id)
+            for field in EmployeeBalance.TOTAL_FIELDS.values():
+                want = totals.get(field, 0)
+                have = getattr(balance, field) if balance else 0
+                if abs(want - have) > tolerance:
+                    mismatches.append(f'user {user_id}: {field} is {have:.2f}, expected {want:.2f}')
+        for mismatch in mismatches:
+            self.stderr.write(mismatch)
+        if mismatches:
+            raise CommandError(f'{len(mismatches)} balance mismatches; run rebuild_balances to fix them.')
+        self.stdout.write(self.style.SUCCESS(f'Balances match the ledger for {len(expected)} employees.'))
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.users.seeding import seed
+
+
+class Command(BaseCommand):
+    help = ('Add a synthetic dataset: employees spread over work sites, monthly time sheets, years of ledger '
+            'entries with history, and documents. Meant for benchmarks and demos, never for production data.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--employees', type=int, default=1000)
+        parser.add_argument('--sites', type=int, default=20)
+        parser.add_argument('--years', type=int, default=2, help='Months of ledger entries, in years.')
+        parser.add_argument('--documents', type=int, default=2, help='Documents per employee.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed; the same seed gives the same data.')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        counts = seed(options['employees'], options['sites'], years=options['years'],
+                      documents=options['documents'], random_seed=options['seed'])
+        summary = ', '.join(f'{count} {name}' for name, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f'Created {summary} in {time.perf_counter() - start:.1f}s.'))
@@ -0,0 +1,37 @@
+# Generated by Django 2.0.13 on 2026-10-18 05:21
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Sum
+
+
+def build_balances(apps, schema_editor):
+    Ledger = apps.get_model('users', 'Ledger')
+    EmployeeBalance = apps.get_model('users', 'EmployeeBalance')
+    fields = {'SALARY': 'salary_total', 'EXPENSE_ADVANCE': 'expense_total'}
+    totals = {}
+    for row in Ledger.objects.values('user_id', 'type').annotate(total=Sum('amount')).order_by():
+        if row['type'] in fields:
+            totals.setdefault(row['user_id'], {})[fields[row['type']]] = row['total']
+    EmployeeBalance.objects.bulk_create(
+        [EmployeeBalance(user_id=user_id, **values) for user_id, values in totals.items()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmployeeBalance',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='balance', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('salary_total', models.FloatField(default=0)),
+                ('expense_total', models.FloatField(default=0)),
+            ],
+        ),
+        migrations.RunPython(build_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.0.13 on 2026-10-18 05:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_employeebalance'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ledger',
+            index=models.Index(fields=['user', 'type', 'amount'], name='ledger_user_type_amount_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ledger',
+            index=models.Index(fields=['-expense_date', 'user', 'type', 'id'], name='ledger_date_user_type_idx'),
+        ),
+    ]
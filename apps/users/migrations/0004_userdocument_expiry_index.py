@@ -0,0 +1,17 @@
+# Generated by Django 2.0.13 on 2026-10-18 05:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_ledger_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userdocument',
+            index=models.Index(fields=['expiry_date', 'document_type'], name='document_expiry_idx'),
+        ),
+    ]
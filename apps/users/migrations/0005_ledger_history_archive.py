@@ -0,0 +1,46 @@
+# Generated by Django 2.0.13 on 2026-10-18 05:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_userdocument_expiry_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerHistoryArchive',
+            fields=[
+                ('history_id', models.IntegerField(primary_key=True, serialize=False)),
+                ('id', models.IntegerField(db_index=True)),
+                ('user_id', models.IntegerField(null=True)),
+                ('type', models.CharField(max_length=50)),
+                ('expense_date', models.DateField()),
+                ('amount', models.FloatField()),
+                ('notes', models.TextField(null=True)),
+                ('time_sheet_record_id', models.IntegerField(null=True)),
+                ('hours', models.FloatField(null=True)),
+                ('hourly_rate', models.FloatField(null=True)),
+                ('trade', models.CharField(max_length=255, null=True)),
+                ('history_date', models.DateTimeField()),
+                ('history_change_reason', models.CharField(max_length=100, null=True)),
+                ('history_type', models.CharField(max_length=1)),
+                ('history_user_id', models.IntegerField(null=True)),
+            ],
+            options={
+                'ordering': ('-history_date', '-history_id'),
+            },
+        ),
+        # HistoricalLedger is generated by simple_history, which has no way to
+        # declare Meta.indexes, so these live outside the model state.
+        migrations.RunSQL(
+            'CREATE INDEX historicalledger_id_date_idx ON users_historicalledger (id, history_date)',
+            'DROP INDEX historicalledger_id_date_idx',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX historicalledger_user_date_idx ON users_historicalledger (history_user_id, history_date)',
+            'DROP INDEX historicalledger_user_date_idx',
+        ),
+    ]
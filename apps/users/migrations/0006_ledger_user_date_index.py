@@ -0,0 +1,17 @@
+# Generated by Django 2.0.13 on 2026-10-18 05:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_ledger_history_archive'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ledger',
+            index=models.Index(fields=['user', 'expense_date', 'type', 'amount'], name='ledger_user_date_amount_idx'),
+        ),
+    ]
@@ -1,18 +1,27 @@
+import hashlib
 from enum import Enum
+from functools import partial
 
-from django.db import models
+from django.apps import apps
+from django.db import DEFAULT_DB_ALIAS, connections, models, transaction
 
 from django.contrib.auth.models import Permission, AbstractUser
-from django.db.models.signals import post_migrate
+from django.db.models.signals import post_migrate, pre_save, post_save, post_delete
+from django.contrib.contenttypes.management import create_contenttypes
 from django.contrib.contenttypes.models import ContentType
 
 from django.core.validators import MinValueValidator
-from django.db.models import Sum
+from django.db.models import Case, Exists, F, OuterRef, Q, Sum, When, Window
+from django.db.models.functions import Coalesce
+from django.utils.html import format_html
 from django.utils.safestring import mark_safe
 
 from django.conf import settings
 from simple_history.models import HistoricalRecords
 
+from apps.users.caching import bump_version, cached, get_version
+from apps.users.thumbnails import schedule_thumbnail, thumbnail_name, thumbnail_url
+
 
 class User(AbstractUser):
     profile_pic = models.FileField()
@@ -28,32 +37,46 @@ class User(AbstractUser):
         return self.get_full_name()
 
     def profile_pic_tag(self):
-        return mark_safe(f'<img src="{settings.MEDIA_URL}/{self.profile_pic}" width="50" height="50" />')
+        return format_html('<img src="{}" width="50" height="50" />', thumbnail_url(self.profile_pic))
 
     profile_pic_tag.short_description = 'Picture'
 
+    def _ledger_total(self, annotation, expense_type):
+        # EmployeeAdmin annotates the totals onto its queryset; fall back to
+        # the maintained EmployeeBalance row for instances loaded elsewhere.
+        if hasattr(self, annotation):
+            return getattr(self, annotation)
+        try:
+            balance = self.balance
+        except EmployeeBalance.DoesNotExist:
+            return 0
+        return balance.total_for(expense_type)
+
     def _total_earning(self):
-        return "{:.2f}".format(Ledger.user_total_expenses_or_earning(
-            self, ExpenseTypes.SALARY.name))
+        return "{:.2f}".format(self._ledger_total('total_earning', ExpenseTypes.SALARY.name))
 
     _total_earning.short_description = "Total Earning"
+    _total_earning.admin_order_field = 'total_earning'
 
     def _total_expenses(self):
-        return "{:.2f}".format(Ledger.user_total_expenses_or_earning(self, ExpenseTypes.EXPENSE_ADVANCE.name))
+        return "{:.2f}".format(self._ledger_total('total_expenses', ExpenseTypes.EXPENSE_ADVANCE.name))
 
     _total_expenses.short_description = "Total Expenses"
+    _total_expenses.admin_order_field = 'total_expenses'
 
     def _current_balance(self):
-        total_earning = Ledger.user_total_expenses_or_earning(
-            self, ExpenseTypes.SALARY.name)
-        total_expenses = Ledger.user_total_expenses_or_earning(
-            self, ExpenseTypes.EXPENSE_ADVANCE.name)
-        current_balance = total_earning - total_expenses
+        if hasattr(self, 'current_balance'):
+            current_balance = self.current_balance
+        else:
+            total_earning = self._ledger_total('total_earning', ExpenseTypes.SALARY.name)
+            total_expenses = self._ledger_total('total_expenses', ExpenseTypes.EXPENSE_ADVANCE.name)
+            current_balance = total_earning - total_expenses
         color = 'style="color: red;"' if current_balance < 0 else ''
         current_balance = "{:.2f}".format(current_balance)
         return mark_safe(f'<span {color}>{current_balance}</span>')
 
     _current_balance.short_description = "Current Balance"
+    _current_balance.admin_order_field = 'current_balance'
 
 
 class TimeStampedModel(models.Model):
@@ -100,6 +123,9 @@ class UserDocument(TimeStampedModel):
     image = models.FileField()
 
     class Meta:
+        indexes = [
+            models.Index(fields=['expiry_date', 'document_type'], name='document_expiry_idx'),
+        ]
         permissions = (
             ('CAN_VIEW_UserDocument', 'Can View UserDocument'),
         )
@@ -108,9 +134,9 @@ class UserDocument(TimeStampedModel):
         return "{}'s {}".format(self.user, self.document_type)
 
     def image_tag(self):
-        return mark_safe(f'<img src="{settings.MEDIA_URL}/{self.image}" width="50" height="50" />')
+        return format_html('<img src="{}" width="50" height="50" />', thumbnail_url(self.image))
 
-    image.short_description = 'Image'
+    image_tag.short_description = 'Image'
 
 
 class TimeSheetMonthlyRecord(TimeStampedModel):
@@ -137,6 +163,78 @@ class ExpenseTypes(Enum):
         return tuple((choice.name, choice.value) for choice in cls)
 
 
+def supports_window_functions(connection):
+    # Django 2.0 has no feature flag for OVER (...); SQLite gained it in 3.25.
+    if connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version_info >= (3, 25)
+    return connection.vendor in ('postgresql', 'oracle')
+
+
+LEDGER_VERSION = 'users.ledger'
+LEDGER_EPOCH = 'users.ledger:epoch'
+# Invalidating more users than this at once starts a new epoch instead.
+USER_INVALIDATION_LIMIT = 100
+LEDGER_CACHE_TIMEOUT = 24 * 60 * 60
+
+
+def user_ledger_version(user_id):
+    """Version of the cached aggregates of one employee's ledger."""
+    return '%s.%s' % (get_version(LEDGER_EPOCH), get_version('%s:user:%s' % (LEDGER_VERSION, user_id)))
+
+
+def invalidate_ledger_caches(user_ids=None):
+    """
+    Drop cached ledger aggregates of the given employees (all when None),
+    and the page level ones. Bulk writes that bypass the Ledger signals must
+    call this, as EmployeeBalance.refresh_for_users() does. The versions are
+    bumped again on commit, so nothing read mid-transaction stays cached.
+    """
+    user_ids = None if user_ids is None else set(user_ids)
+
+    def bump():
+        bump_version(LEDGER_VERSION)
+        if user_ids is None or len(user_ids) > USER_INVALIDATION_LIMIT:
+            bump_version(LEDGER_EPOCH)
+        else:
+            for user_id in user_ids:
+                bump_version('%s:user:%s' % (LEDGER_VERSION, user_id))
+
+    bump()
+    transaction.on_commit(bump)
+    if user_ids is None:
+        invalidate_monthly_reports()
+
+
+REPORTS_VERSION = 'users.reports'
+
+
+def _report_month_namespace(day):
+    # str() also covers dates assigned as 'YYYY-MM-DD' strings and not yet
+    # converted by a full_clean().
+    return '%s:%s' % (REPORTS_VERSION, str(day)[:7])
+
+
+def report_month_version(month):
+    """Version of the cached reports over one month's ledger entries."""
+    return '%s.%s' % (get_version(REPORTS_VERSION), get_version(_report_month_namespace(month)))
+
+
+def invalidate_monthly_reports(dates=None):
+    """
+    Drop cached reports of the months the given dates fall in (all months
+    when None). Bulk writes that bypass the Ledger signals must call this
+    with the expense dates they touched; bumped again on commit.
+    """
+    namespaces = [REPORTS_VERSION] if dates is None else {_report_month_namespace(day) for day in dates}
+
+    def bump():
+        for namespace in namespaces:
+            bump_version(namespace)
+
+    bump()
+    transaction.on_commit(bump)
+
+
 class Ledger(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.PROTECT, related_name='ledgers')
     type = models.CharField(
@@ -156,6 +254,14 @@ class Ledger(models.Model):
 
     class Meta:
         ordering = ('-expense_date', 'user', 'type')
+        indexes = [
+            # Per-user totals filter on user and type and only read amount.
+            models.Index(fields=['user', 'type', 'amount'], name='ledger_user_type_amount_idx'),
+            # Matches Meta.ordering (plus id as tiebreaker) for the changelist and date filters.
+            models.Index(fields=['-expense_date', 'user', 'type', 'id'], name='ledger_date_user_type_idx'),
+            # Per-user totals up to a date: a range on expense_date within the user, covering type and amount.
+            models.Index(fields=['user', 'expense_date', 'type', 'amount'], name='ledger_user_date_amount_idx'),
+        ]
         permissions = (
             ('CAN_VIEW_Ledger', 'Can View Ledger'),
         )
@@ -168,18 +274,363 @@ class Ledger(models.Model):
 
         return total_expense_or_earning.get('total') if total_expense_or_earning else 0
 
+    @classmethod
+    def history_as_of(cls, recorded_at):
+        """
+        The version of every ledger entry that was current at recorded_at,
+        from HistoricalLedger; entries deleted by then are left out.
+        """
+        history = cls.history.model.objects
+        later = history.filter(id=OuterRef('id'), history_date__lte=recorded_at).filter(
+            Q(history_date__gt=OuterRef('history_date')) |
+            Q(history_date=OuterRef('history_date'), history_id__gt=OuterRef('history_id')))
+        return history.filter(history_date__lte=recorded_at).annotate(
+            superseded=Exists(later),
+        ).filter(superseded=False).exclude(history_type='-')
+
+    @classmethod
+    def user_totals_as_of(cls, user, as_of=None, recorded_at=None):
+        """
+        Salary and expense totals of user, and the balance they give, over the
+        entries dated up to as_of (all when None), as the ledger stood at
+        recorded_at (now when None). One indexed aggregate query either way.
+        """
+        user_id = getattr(user, 'pk', user)
+        key = 'ledger-as-of:%s:%s:%s:%s' % (
+            user_id, as_of and as_of.isoformat(), recorded_at and recorded_at.isoformat(),
+            user_ledger_version(user_id))
+        return cached('balances as of', key, lambda: cls._user_totals_as_of(user_id, as_of, recorded_at),
+                      LEDGER_CACHE_TIMEOUT)
+
+    @classmethod
+    def _user_totals_as_of(cls, user_id, as_of, recorded_at):
+        entries = cls.objects.all() if recorded_at is None else cls.history_as_of(recorded_at)
+        entries = entries.filter(user_id=user_id)
+        if as_of is not None:
+            entries = entries.filter(expense_date__lte=as_of)
+        totals = entries.aggregate(**{
+            field: Coalesce(Sum('amount', filter=Q(type=expense_type)), 0)
+            for expense_type, field in EmployeeBalance.TOTAL_FIELDS.items()
+        })
+        totals['balance'] = totals['salary_total'] - totals['expense_total']
+        return totals
+
+    @classmethod
+    def running_balances(cls, entries):
+        """
+        {id: balance after the entry} for the given saved entries: salary
+        minus expenses over all of the employee's entries up to and including
+        it, in expense_date (then id) order. One query for all the entries.
+        """
+        ids = [entry.pk for entry in entries]
+        if not ids:
+            return {}
+        user_ids = {entry.user_id for entry in entries}
+        key = 'ledger-running:%s:%s' % (
+            get_version(LEDGER_VERSION), hashlib.md5(','.join(map(str, sorted(ids))).encode()).hexdigest())
+        return cached('running balances', key, lambda: cls._running_balances(ids, user_ids), LEDGER_CACHE_TIMEOUT)
+
+    @classmethod
+    def _running_balances(cls, ids, user_ids):
+        ledgers = cls.objects.filter(user_id__in=user_ids).order_by()
+        if not supports_window_functions(connections[ledgers.db]):
+            return cls._streamed_running_balances(ledgers, ids)
+
+        # The window has to see every entry of the employees, so it runs in a
+        # subquery and only the wanted rows are picked from it.
+        signed_amount = Case(When(type=ExpenseTypes.SALARY.name, then=F('amount')), default=F('amount') * -1,
+                             output_field=models.FloatField())
+        sql, params = ledgers.annotate(running_balance=Window(
+            Sum(signed_amount), partition_by=[F('user_id')], order_by=[F('expense_date').asc(), F('id').asc()],
+        )).values('id', 'running_balance').query.sql_with_params()
+        with connections[ledgers.db].cursor() as cursor:
+            cursor.execute('SELECT id, running_balance FROM (%s) running WHERE id IN (%s)' % (
+                sql, ', '.join(['%s'] * len(ids))), list(params) + ids)
+            return dict(cursor.fetchall())
+
+    @staticmethod
+    def _streamed_running_balances(ledgers, ids):
+        wanted = set(ids)
+        balances, running, current_user = {}, 0, None
+        rows = ledgers.order_by('user_id', 'expense_date', 'id').values_list('id', 'user_id', 'type', 'amount')
+        for pk, user_id, expense_type, amount in rows.iterator(chunk_size=2000):
+            if user_id != current_user:
+                running, current_user = 0, user_id
+            running += amount if expense_type == ExpenseTypes.SALARY.name else -amount
+            if pk in wanted:
+                balances[pk] = running
+        return balances
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._balance_state = instance.balance_state()
+        instance._saved_expense_date = instance.expense_date
+        return instance
+
+    def balance_state(self):
+        # amount may still be the string it was assigned, as with form data.
+        return self.user_id, self.type, self._meta.get_field('amount').to_python(self.amount)
+
+    def save(self, *args, **kwargs):
+        # The post_save handler updates EmployeeBalance; keep both writes in
+        # one transaction.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super().delete(*args, **kwargs)
+
+
+class LedgerHistoryArchive(models.Model):
+    """
+    HistoricalLedger rows moved out of the live history table by
+    compact_ledger_history, column for column. References are plain ids
+    since the rows they point at may be gone.
+    """
+    history_id = models.IntegerField(primary_key=True)
+    id = models.IntegerField(db_index=True)
+    user_id = models.IntegerField(null=True)
+    type = models.CharField(max_length=50)
+    expense_date = models.DateField()
+    amount = models.FloatField()
+    notes = models.TextField(null=True)
+    time_sheet_record_id = models.IntegerField(null=True)
+    hours = models.FloatField(null=True)
+    hourly_rate = models.FloatField(null=True)
+    trade = models.CharField(max_length=255, null=True)
+    history_date = models.DateTimeField()
+    history_change_reason = models.CharField(max_length=100, null=True)
+    history_type = models.CharField(max_length=1)
+    history_user_id = models.IntegerField(null=True)
+
+    class Meta:
+        ordering = ('-history_date', '-history_id')
+
+
+class EmployeeBalance(models.Model):
+    """
+    Running salary and expense totals per employee, kept in step with Ledger
+    so balances can be read without summing the whole ledger history.
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True,
+                                related_name='balance')
+    salary_total = models.FloatField(default=0)
+    expense_total = models.FloatField(default=0)
+
+    TOTAL_FIELDS = {
+        ExpenseTypes.SALARY.name: 'salary_total',
+        ExpenseTypes.EXPENSE_ADVANCE.name: 'expense_total',
+    }
+
+    def __str__(self):
+        return f"{self.user}: {self.current_balance:.2f}"
+
+    @property
+    def current_balance(self):
+        return self.salary_total - self.expense_total
+
+    def total_for(self, expense_type):
+        return getattr(self, self.TOTAL_FIELDS[expense_type])
+
+    @classmethod
+    def apply_delta(cls, user_id, expense_type, amount):
+        field = cls.TOTAL_FIELDS[expense_type]
+        updated = cls.objects.filter(user_id=user_id).update(**{field: F(field) + amount})
+        if not updated:
+            # No summary row yet: build it from the ledger, which already
+            # includes the change being applied.
+            cls.refresh_for_users([user_id])
+
+    @classmethod
+    def compute_totals(cls, user_ids=None):
+        """Return {user_id: {field: total}} recomputed from Ledger."""
+        ledgers = Ledger.objects.all()
+        if user_ids is not None:
+            ledgers = ledgers.filter(user_id__in=user_ids)
+        totals = {}
+        for row in ledgers.values('user_id', 'type').annotate(total=Sum('amount')).order_by():
+            field = cls.TOTAL_FIELDS.get(row['type'])
+            if field:
+                totals.setdefault(row['user_id'], {})[field] = row['total']
+        return totals
+
+    @classmethod
+    def refresh_for_users(cls, user_ids):
+        """Recompute the summary rows of the given users, e.g. after a bulk write."""
+        user_ids = set(user_ids)
+        totals = cls.compute_totals(user_ids)
+        with transaction.atomic():
+            cls.objects.filter(user_id__in=user_ids).delete()
+            cls.objects.bulk_create(
+                [cls(user_id=user_id, **totals.get(user_id, {})) for user_id in user_ids])
+            invalidate_ledger_caches(user_ids)
+
+    @classmethod
+    def rebuild(cls, batch_size=None):
+        """Recompute every summary row from Ledger in bulk."""
+        totals = cls.compute_totals()
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(
+                [cls(user_id=user_id, **fields) for user_id, fields in totals.items()], batch_size=batch_size)
+            invalidate_ledger_caches()
+        return len(totals)
+
+
+def update_balance_on_ledger_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old_state = getattr(instance, '_balance_state', None)
+    new_state = instance.balance_state()
+    if old_state == new_state:
+        return
+    if old_state is not None:
+        user_id, expense_type, amount = old_state
+        EmployeeBalance.apply_delta(user_id, expense_type, -amount)
+    user_id, expense_type, amount = new_state
+    EmployeeBalance.apply_delta(user_id, expense_type, amount)
+    instance._balance_state = new_state
+
+
+def update_balance_on_ledger_delete(sender, instance, **kwargs):
+    user_id, expense_type, amount = getattr(instance, '_balance_state', None) or instance.balance_state()
+    EmployeeBalance.apply_delta(user_id, expense_type, -amount)
+
+
+def invalidate_ledger_caches_on_change(sender, instance, **kwargs):
+    # Connected before the balance handlers, which reset _balance_state: an
+    # entry moved to another employee changes both employees' aggregates.
+    old_state = getattr(instance, '_balance_state', None)
+    invalidate_ledger_caches({instance.user_id, old_state[0] if old_state else instance.user_id})
+    invalidate_monthly_reports({instance.expense_date, getattr(instance, '_saved_expense_date', instance.expense_date)})
+    instance._saved_expense_date = instance.expense_date
+
+
+def invalidate_reports_on_time_sheet_change(sender, instance, created=False, **kwargs):
+    # Moving a time sheet to another site, or deleting it (which unlinks its
+    # entries), changes the site of entries of any month.
+    if not created:
+        invalidate_monthly_reports()
+
+
+post_save.connect(invalidate_ledger_caches_on_change, sender=Ledger)
+post_delete.connect(invalidate_ledger_caches_on_change, sender=Ledger)
+post_save.connect(update_balance_on_ledger_save, sender=Ledger)
+post_delete.connect(update_balance_on_ledger_delete, sender=Ledger)
+post_save.connect(invalidate_reports_on_time_sheet_change, sender=TimeSheetMonthlyRecord)
+post_delete.connect(invalidate_reports_on_time_sheet_change, sender=TimeSheetMonthlyRecord)
+
+
+def make_thumbnails_on_upload(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Saves of other fields only, like the last_login update on every login, leave the images alone.
+    field_names = [name for name in THUMBNAIL_FIELDS[sender] if update_fields is None or name in update_fields]
+    if raw or not field_names:
+        return
+    for field_name in field_names:
+        name = getattr(instance, field_name).name
+        if name:
+            transaction.on_commit(lambda name=name: schedule_thumbnail(name))
+
+
+THUMBNAIL_FIELDS = {
+    User: ('profile_pic',),
+    UserDocument: ('image',),
+}
+
+for model in THUMBNAIL_FIELDS:
+    post_save.connect(make_thumbnails_on_upload, sender=model)
+
+
+def release_file(storage, name):
+    # ContentAddressedStorage keeps blobs that other rows still refer to.
+    storage.delete(name)
+    if not storage.exists(name):
+        storage.delete(thumbnail_name(name))
+
+
+def remember_replaced_files(sender, instance, raw=False, update_fields=None, **kwargs):
+    field_names = [name for name in FILE_FIELDS[sender] if update_fields is None or name in update_fields]
+    if raw or instance.pk is None or not field_names:
+        return
+    stored = sender._default_manager.filter(pk=instance.pk).values(*field_names).first() or {}
+    instance._replaced_files = [
+        (getattr(instance, name).storage, stored[name]) for name in field_names
+        if stored.get(name) and stored[name] != getattr(instance, name).name
+    ]
+
+
+def release_replaced_files(sender, instance, **kwargs):
+    for storage, name in getattr(instance, '_replaced_files', ()):
+        transaction.on_commit(partial(release_file, storage, name))
+    instance._replaced_files = []
+
+
+def release_deleted_files(sender, instance, **kwargs):
+    for field_name in FILE_FIELDS[sender]:
+        file = getattr(instance, field_name)
+        if file:
+            transaction.on_commit(partial(release_file, file.storage, file.name))
+
+
+FILE_FIELDS = {
+    User: ('profile_pic',),
+    UserDocument: ('image',),
+    TimeSheetMonthlyRecord: ('time_sheet_file',),
+}
+
+for model in FILE_FIELDS:
+    pre_save.connect(remember_replaced_files, sender=model)
+    post_save.connect(release_replaced_files, sender=model)
+    post_delete.connect(release_deleted_files, sender=model)
+
+
+def invalidate_documents_cache(sender, **kwargs):
+    bump_version('documents')
+
+
+post_save.connect(invalidate_documents_cache, sender=UserDocument)
+post_delete.connect(invalidate_documents_cache, sender=UserDocument)
+
+
+def _last_post_migrate_app():
+    # emit_post_migrate_signal() walks the app configs in this order, skipping
+    # apps without a models module.
+    app_configs = [app_config for app_config in apps.get_app_configs() if app_config.models_module is not None]
+    return app_configs[-1] if app_configs else None
+
+
+def add_view_only_permission(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    '''This creates a view only permission for every content type'''
+    # post_migrate fires once per app; run once, for the last app. This
+    # receiver is connected when users.models is imported, before
+    # contenttypes connects create_contenttypes, so the last app's content
+    # types are created here first; every other app's already exist.
+    if sender is not _last_post_migrate_app():
+        return
+    create_contenttypes(using=using, **kwargs)
+    existing = set(Permission.objects.using(using).filter(
+        codename__startswith='can_view_').values_list('content_type_id', 'codename'))
+    Permission.objects.using(using).bulk_create([
+        Permission(content_type=content_type,
+                   codename='can_view_%s' % content_type.model,
+                   name='Can View %s' % content_type.name)
+        for content_type in ContentType.objects.using(using).all()
+        if (content_type.pk, 'can_view_%s' % content_type.model) not in existing
+    ])
+
+
+post_migrate.connect(add_view_only_permission, dispatch_uid='users.add_view_only_permission')
+
+
+def ensure_search_indexes_after_migrate(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    # Once, after the last app: a migration of any app may have rebuilt a
+    # searched table, which drops its triggers.
+    if sender is not _last_post_migrate_app():
+        return
+    from apps.users.search import ensure_search_indexes
+    ensure_search_indexes(connections[using])
+
 
-def add_view_only_permission(sender, **kwargs):
-    '''This creates a view only permission for sender'''
-    for content_type in ContentType.objects.all():
-        codename = 'can_view_%s' % content_type.model
-        name = 'Can View %s' % content_type.name
-        if not Permission.objects.filter(
-            content_type=content_type,
-            codename=codename):
-            Permission.objects.create(
-            content_type=content_type,
-            codename=codename,
-            name=name)
-
-post_migrate.connect(add_view_only_permission)
+post_migrate.connect(ensure_search_indexes_after_migrate, dispatch_uid='users.ensure_search_indexes')
@@ -0,0 +1,154 @@
+import base64
+import hashlib
+import json
+from functools import reduce
+from operator import or_
+
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ALL_VAR, ORDER_VAR, ChangeList
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from apps.users.caching import cached, get_version
+
+CURSOR_VAR = 'cursor'
+AFTER = 'after'
+BEFORE = 'before'
+
+
+class CachedCountPaginator(Paginator):
+    """
+    Paginator that caches COUNT(*) per distinct query for a few minutes, so
+    reloading or paging through a wide filter doesn't count the table again.
+    Counts are also keyed by the model's cache version (see caching.py), so
+    models that bump it on save and delete show new counts at once; after
+    writes that send no signals (queryset update() and delete(), raw SQL) a
+    count can lag by up to count_timeout seconds.
+    """
+    count_timeout = 300
+
+    @cached_property
+    def count(self):
+        sql, params = self.object_list.query.sql_with_params()
+        key = 'changelist-count:%s:%s' % (get_version(self.object_list.model._meta.label_lower),
+                                          hashlib.md5(f'{sql}|{params}'.encode()).hexdigest())
+        return cached('changelist counts', key, lambda: super(CachedCountPaginator, self).count, self.count_timeout)
+
+
+def keyset_filter(fields, values, reverse=False):
+    """
+    Q matching the rows that come after values in the ordering given by
+    fields (names with an optional '-' prefix), or before them if reverse.
+    """
+    clauses = []
+    for i, field in enumerate(fields):
+        descending = field.startswith('-')
+        name = field.lstrip('-')
+        lookup = 'lt' if descending != reverse else 'gt'
+        equal = {f.lstrip('-'): value for f, value in zip(fields[:i], values[:i])}
+        clauses.append(Q(**equal, **{f'{name}__{lookup}': values[i]}))
+    # The redundant bound on the leading column lets the database seek into
+    # the index instead of scanning it from the start.
+    first = fields[0]
+    bound = 'lte' if first.startswith('-') != reverse else 'gte'
+    return Q(**{f'{first.lstrip("-")}__{bound}': values[0]}) & reduce(or_, clauses)
+
+
+class KeysetChangeList(ChangeList):
+    """
+    ChangeList that pages with a cursor over model_admin.keyset_ordering
+    instead of OFFSET, so every page costs the same however deep it is.
+
+    Used while the default ordering is in effect; sorting by a column,
+    "show all" or searching (which ranks the matches) falls back to the
+    standard page-number pagination.
+    """
+
+    def __init__(self, request, *args, **kwargs):
+        self.cursor = request.GET.get(CURSOR_VAR)
+        super().__init__(request, *args, **kwargs)
+
+    @property
+    def keyset_ordering(self):
+        return self.model_admin.keyset_ordering
+
+    @property
+    def uses_keyset(self):
+        return ORDER_VAR not in self.params and ALL_VAR not in self.params and not self.query
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_query_string(self, new_params=None, remove=None):
+        # Changing filters or sorting starts again from the first page.
+        remove = list(remove or [])
+        if CURSOR_VAR not in (new_params or {}):
+            remove.append(CURSOR_VAR)
+        return super().get_query_string(new_params, remove)
+
+    def get_ordering(self, request, queryset):
+        if self.uses_keyset:
+            return list(self.keyset_ordering)
+        return super().get_ordering(request, queryset)
+
+    def encode_cursor(self, direction, obj):
+        values = [getattr(obj, self.lookup_opts.get_field(f.lstrip('-')).attname) for f in self.keyset_ordering]
+        data = json.dumps([direction] + values, cls=DjangoJSONEncoder)
+        return base64.urlsafe_b64encode(data.encode()).decode()
+
+    def decode_cursor(self):
+        try:
+            direction, *raw_values = json.loads(base64.urlsafe_b64decode(self.cursor.encode()).decode())
+            if direction not in (AFTER, BEFORE) or len(raw_values) != len(self.keyset_ordering):
+                raise ValueError(self.cursor)
+            values = [self.lookup_opts.get_field(f.lstrip('-')).to_python(value)
+                      for f, value in zip(self.keyset_ordering, raw_values)]
+        except (ValueError, TypeError, ValidationError) as e:
+            raise IncorrectLookupParameters(e)
+        return direction, values
+
+    def get_results(self, request):
+        if not self.uses_keyset:
+            return super().get_results(request)
+
+        paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        result_count = paginator.count
+        if self.model_admin.show_full_result_count:
+            full_result_count = self.root_queryset.count()
+        else:
+            full_result_count = None
+
+        direction, queryset = None, self.queryset
+        if self.cursor:
+            direction, values = self.decode_cursor()
+            queryset = queryset.filter(keyset_filter(self.keyset_ordering, values, reverse=direction == BEFORE))
+            if direction == BEFORE:
+                queryset = queryset.reverse()
+        result_list = list(queryset[:self.list_per_page + 1])
+        has_more = len(result_list) > self.list_per_page
+        result_list = result_list[:self.list_per_page]
+        if direction == BEFORE:
+            result_list.reverse()
+            has_previous, has_next = has_more, True
+        else:
+            has_previous, has_next = direction is not None, has_more
+
+        self.first_page_url = self.get_query_string() if has_previous else None
+        self.previous_page_url = has_previous and result_list and self.get_query_string(
+            {CURSOR_VAR: self.encode_cursor(BEFORE, result_list[0])})
+        self.next_page_url = has_next and result_list and self.get_query_string(
+            {CURSOR_VAR: self.encode_cursor(AFTER, result_list[-1])})
+
+        self.result_count = result_count
+        self.show_full_result_count = self.model_admin.show_full_result_count
+        self.show_admin_actions = not self.show_full_result_count or bool(full_result_count)
+        self.full_result_count = full_result_count
+        self.result_list = result_list
+        self.can_show_all = result_count <= self.list_max_show_all
+        self.multi_page = has_previous or has_next
+        self.paginator = paginator
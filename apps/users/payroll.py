@@ -0,0 +1,76 @@
+from django.db import transaction
+
+from apps.users.bulk import bulk_create_with_history, bulk_delete_with_history, bulk_update_with_history
+from apps.users.models import (
+    EmployeeBalance, ExpenseTypes, Ledger, TimeSheetMonthlyRecord, User, invalidate_monthly_reports,
+)
+
+ENTRY_FIELDS = ('hours', 'hourly_rate', 'trade', 'notes')
+
+
+def get_time_sheet_record(work_site, work_month):
+    return TimeSheetMonthlyRecord.objects.filter(work_site=work_site, work_month=work_month).first()
+
+
+def payroll_initial(work_site, work_month):
+    """
+    One row per active employee (plus anyone already paid on the sheet),
+    prefilled from their SALARY entry on the site's record for the month.
+    """
+    record = get_time_sheet_record(work_site, work_month)
+    entries = {}
+    if record:
+        for ledger in record.ledger_set.filter(type=ExpenseTypes.SALARY.name).order_by('id'):
+            entries.setdefault(ledger.user_id, ledger)
+
+    employees = User.objects.filter(is_active=True) | User.objects.filter(pk__in=list(entries))
+    rows = []
+    for user in employees.order_by('first_name', 'last_name', 'username'):
+        row = {'user_id': user.pk, 'name': user.get_full_name() or user.username}
+        entry = entries.get(user.pk)
+        if entry:
+            row.update({field: getattr(entry, field) for field in ENTRY_FIELDS})
+        rows.append(row)
+    return rows
+
+
+def save_payroll(work_site, work_month, rows, history_user=None):
+    """
+    Create, update or delete the SALARY entries of work_site's time sheet
+    record for work_month from the cleaned formset rows, in one transaction.
+    Rows without hours and rate remove any existing entry.
+    Returns (created, updated, deleted) counts.
+    """
+    with transaction.atomic():
+        record, _ = TimeSheetMonthlyRecord.objects.get_or_create(work_site=work_site, work_month=work_month)
+        existing = {}
+        for ledger in record.ledger_set.filter(type=ExpenseTypes.SALARY.name).order_by('id'):
+            existing.setdefault(ledger.user_id, ledger)
+
+        known_users = set(User.objects.filter(pk__in=[row['user_id'] for row in rows]).values_list('pk', flat=True))
+        to_create, to_update, to_delete = [], [], []
+        for row in rows:
+            if row['user_id'] not in known_users:
+                continue
+            ledger = existing.get(row['user_id'])
+            if row.get('hours') is None or row.get('hourly_rate') is None:
+                if ledger:
+                    to_delete.append(ledger)
+                continue
+            values = {field: row.get(field) or None for field in ENTRY_FIELDS}
+            values['hours'], values['hourly_rate'] = row['hours'], row['hourly_rate']
+            values['amount'] = row['hours'] * row['hourly_rate']
+            if ledger is None:
+                to_create.append(Ledger(user_id=row['user_id'], type=ExpenseTypes.SALARY.name,
+                                        expense_date=work_month, time_sheet_record=record, **values))
+            elif any(getattr(ledger, field) != value for field, value in values.items()):
+                for field, value in values.items():
+                    setattr(ledger, field, value)
+                to_update.append(ledger)
+
+        bulk_create_with_history(to_create, Ledger, history_user=history_user)
+        bulk_update_with_history(to_update, Ledger, ENTRY_FIELDS + ('amount',), history_user=history_user)
+        bulk_delete_with_history(to_delete, Ledger, history_user=history_user)
+        EmployeeBalance.refresh_for_users([ledger.user_id for ledger in to_create + to_update + to_delete])
+        invalidate_monthly_reports({ledger.expense_date for ledger in to_create + to_update + to_delete})
+    return len(to_create), len(to_update), len(to_delete)
@@ -0,0 +1,124 @@
+"""
+Opt-in request profiling: wall time, SQL query count and SQL time of every
+request, aggregated per URL pattern into in-memory histograms, with slow
+requests logged along with their repeated queries (the usual sign of an
+N+1 pattern). Statistics are kept per process and reset on restart.
+"""
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds, in milliseconds, of the wall time histogram buckets.
+BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float('inf'))
+BUCKET_LABELS = ['<=%d' % bound for bound in BUCKETS[:-1]] + ['>%d' % BUCKETS[-2]]
+IN_LIST_RE = re.compile(r'\((?:%s, )+%s\)')
+
+_stats = {}
+_lock = threading.Lock()
+
+
+def fingerprint(sql):
+    """The SQL with IN lists of any length collapsed, so repeats of one query shape compare equal."""
+    return IN_LIST_RE.sub('(...)', sql)
+
+
+class QueryRecorder:
+    """connection.execute_wrapper() callable counting and timing the queries it sees."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def duplicates(self):
+        return [(sql, count) for sql, count in self.fingerprints.most_common() if count > 1]
+
+
+def record(pattern, duration, recorder):
+    milliseconds = duration * 1000
+    with _lock:
+        stats = _stats.get(pattern)
+        if stats is None:
+            stats = _stats[pattern] = {
+                'requests': 0, 'time_ms': 0.0, 'max_ms': 0.0, 'queries': 0, 'max_queries': 0, 'sql_ms': 0.0,
+                'histogram': [0] * len(BUCKETS),
+            }
+        stats['requests'] += 1
+        stats['time_ms'] += milliseconds
+        stats['max_ms'] = max(stats['max_ms'], milliseconds)
+        stats['queries'] += recorder.count
+        stats['max_queries'] = max(stats['max_queries'], recorder.count)
+        stats['sql_ms'] += recorder.duration * 1000
+        stats['histogram'][next(i for i, bound in enumerate(BUCKETS) if milliseconds <= bound)] += 1
+
+
+def request_stats():
+    """Per URL pattern totals, averages and the wall time histogram, slowest average first."""
+    with _lock:
+        items = [(pattern, dict(stats, histogram=list(stats['histogram']))) for pattern, stats in _stats.items()]
+    result = {}
+    for pattern, stats in sorted(items, key=lambda item: -item[1]['time_ms'] / item[1]['requests']):
+        requests = stats['requests']
+        stats['avg_ms'] = stats['time_ms'] / requests
+        stats['avg_queries'] = stats['queries'] / requests
+        stats['avg_sql_ms'] = stats['sql_ms'] / requests
+        stats['histogram'] = dict(zip(BUCKET_LABELS, stats['histogram']))
+        result[pattern] = stats
+    return result
+
+
+def reset_stats():
+    with _lock:
+        _stats.clear()
+
+
+class RequestProfilingMiddleware:
+    """Enabled by settings.REQUEST_PROFILING; requests slower than REQUEST_PROFILING_SLOW_MS are logged."""
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slow_ms = settings.REQUEST_PROFILING_SLOW_MS
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        match = request.resolver_match
+        pattern = (match.view_name or match._func_path) if match else 'unresolved'
+        record(pattern, duration, recorder)
+        if duration * 1000 >= self.slow_ms:
+            self.log_slow_request(request, pattern, duration, recorder)
+        return response
+
+    def log_slow_request(self, request, pattern, duration, recorder):
+        duplicates = recorder.duplicates()
+        lines = ['%dx %s' % (count, sql) for sql, count in duplicates[:5]]
+        logger.warning(
+            'Slow request %s %s (%s): %.0f ms, %d queries in %.0f ms, %d repeated query shapes%s',
+            request.method, request.get_full_path(), pattern, duration * 1000, recorder.count,
+            recorder.duration * 1000, len(duplicates), ''.join('\n  ' + line for line in lines))
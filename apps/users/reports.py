@@ -0,0 +1,120 @@
+"""
+Monthly payroll and site costs: Ledger totals per month, work site, trade
+and entry type, optionally per employee too, summed in the database by a
+GROUP BY query per month. Closed months are cached until a change to one of
+their entries bumps the month's version (see invalidate_monthly_reports);
+the current month is recomputed on every request.
+"""
+from collections import OrderedDict
+from datetime import date
+
+from django.db.models import Count, Sum
+
+from apps.users.caching import cached_many
+from apps.users.documents import NO_SITE
+from apps.users.models import ExpenseTypes, Ledger, User, WorkSite, report_month_version
+
+REPORT_MONTHS = 12
+NO_TRADE = 'No trade'
+COLUMNS = ('month', 'work_site', 'trade', 'type', 'employees', 'entries', 'hours', 'amount')
+EMPLOYEE_COLUMNS = ('month', 'work_site', 'employee', 'trade', 'type', 'entries', 'hours', 'amount')
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def report_months(last_month, count=REPORT_MONTHS):
+    """First days of the count months up to and including last_month's, oldest first."""
+    last_month = last_month.replace(day=1)
+    return [add_months(last_month, offset) for offset in range(1 - count, 1)]
+
+
+def monthly_costs(months, by_employee=False, work_site=None, today=None):
+    """
+    {month: [row, ...]} for the given month starts, each row a dict of
+    COLUMNS (EMPLOYEE_COLUMNS when by_employee) plus work_site_id, sorted by
+    work site, employee, trade and type. Only work_site's rows when given.
+    """
+    current = (today or date.today()).replace(day=1)
+    kind = 'employee costs' if by_employee else 'site costs'
+    closed = OrderedDict(
+        (month, 'reports:%s:%s:%s' % (kind.replace(' ', '-'), month.isoformat(), report_month_version(month)))
+        for month in months if month < current)
+    groups = cached_many(kind, closed, lambda missing: _query_groups(missing, by_employee))
+    open_months = [month for month in months if month >= current]
+    if open_months:
+        groups.update(_query_groups(open_months, by_employee))
+    if work_site is not None:
+        site_id = getattr(work_site, 'pk', work_site)
+        groups = {month: [row for row in rows if row['time_sheet_record__work_site'] == site_id]
+                  for month, rows in groups.items()}
+    return _label(OrderedDict((month, groups[month]) for month in months), by_employee)
+
+
+def _query_groups(months, by_employee):
+    """
+    {month: [grouped values, ...]}, one indexed range query per month. A
+    single query grouping on TruncMonth() would run SQLite's date function
+    on every row, which doubles the time.
+    """
+    keys = ['time_sheet_record__work_site', 'trade', 'type'] + (['user'] if by_employee else [])
+    totals = {'entries': Count('id'), 'hours': Sum('hours'), 'amount': Sum('amount')}
+    if not by_employee:
+        totals['employees'] = Count('user', distinct=True)
+    return {
+        month: list(Ledger.objects.filter(
+            expense_date__gte=month, expense_date__lt=add_months(month, 1),
+        ).values(*keys).annotate(**totals).order_by())
+        for month in months
+    }
+
+
+def _label(groups, by_employee):
+    sites = dict(WorkSite.objects.values_list('pk', 'name'))
+    employees = {}
+    if by_employee:
+        employees = {pk: ' '.join(filter(None, (first_name, last_name))) or username
+                     for pk, username, first_name, last_name in
+                     User.objects.values_list('pk', 'username', 'first_name', 'last_name')}
+    types = dict(ExpenseTypes.choices())
+
+    report = OrderedDict()
+    for month, rows in groups.items():
+        labelled = []
+        for row in rows:
+            site_id = row['time_sheet_record__work_site']
+            labelled.append({
+                'month': month,
+                'work_site_id': site_id,
+                'work_site': sites.get(site_id, NO_SITE),
+                'employee': employees.get(row.get('user'), row.get('user')),
+                'trade': row['trade'] or NO_TRADE,
+                'type': types.get(row['type'], row['type']),
+                'employees': row.get('employees'),
+                'entries': row['entries'],
+                'hours': row['hours'] or 0,
+                'amount': row['amount'],
+            })
+        labelled.sort(key=lambda row: (row['work_site'], str(row['employee'] or ''), row['trade'], row['type']))
+        report[month] = labelled
+    return report
+
+
+def month_totals(rows):
+    """Hours and salary and expense amounts over one month's report rows."""
+    totals = {'hours': 0, 'salary': 0, 'expenses': 0}
+    for row in rows:
+        totals['hours'] += row['hours']
+        totals['salary' if row['type'] == ExpenseTypes.SALARY.value else 'expenses'] += row['amount']
+    return totals
+
+
+def report_rows(report, by_employee=False):
+    """The report as a header and value rows, for CSV."""
+    columns = EMPLOYEE_COLUMNS if by_employee else COLUMNS
+    yield list(columns)
+    for month, rows in report.items():
+        for row in rows:
+            yield [month.strftime('%Y-%m') if column == 'month' else row[column] for column in columns]
@@ -0,0 +1,150 @@
+"""
+Full-text search for the admin changelists, over ledger notes, time sheet
+notes and document names and descriptions.
+
+On SQLite each searched table gets an FTS5 index (an external content
+table, so the text isn't stored twice) that triggers keep in step with every
+insert, update and delete, including bulk inserts, queryset updates and raw
+deletes that send no signals. The indexes are created, or repaired after a
+migration rebuilt their table, on post_migrate. Other backends, and SQLite
+builds without FTS5, keep the admin's usual search_fields lookups.
+"""
+from django.apps import apps
+from django.db import OperationalError, connections, router
+
+# Searched columns per model; the admin's search_fields for the fallback.
+SEARCH_INDEXES = {
+    'users.ledger': ('notes',),
+    'users.timesheetmonthlyrecord': ('notes',),
+    'users.userdocument': ('name', 'description'),
+}
+
+_ready = set()
+
+
+def search_table(model):
+    return '%s_search' % model._meta.db_table
+
+
+def fts5_available(connection):
+    if connection.vendor != 'sqlite':
+        return False
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE VIRTUAL TABLE IF NOT EXISTS temp.fts5_probe USING fts5(text)')
+            cursor.execute('DROP TABLE temp.fts5_probe')
+    except OperationalError:
+        return False
+    return True
+
+
+def _index_statements(model, columns, connection):
+    """[(sqlite_master name, CREATE statement)] of model's search table and its triggers."""
+    quote_name = connection.ops.quote_name
+    fts = search_table(model)
+    table, pk = quote_name(model._meta.db_table), quote_name(model._meta.pk.column)
+    names = ', '.join(quote_name(model._meta.get_field(column).column) for column in columns)
+    new = ', '.join('new.%s' % quote_name(model._meta.get_field(column).column) for column in columns)
+    old = ', '.join('old.%s' % quote_name(model._meta.get_field(column).column) for column in columns)
+    insert = 'INSERT INTO %s(rowid, %s) VALUES (new.%s, %s);' % (quote_name(fts), names, pk, new)
+    delete = "INSERT INTO %s(%s, rowid, %s) VALUES ('delete', old.%s, %s);" % (
+        quote_name(fts), quote_name(fts), names, pk, old)
+    return [
+        (fts, 'CREATE VIRTUAL TABLE %s USING fts5(%s, content=%s, content_rowid=%s)' % (
+            quote_name(fts), names, table, pk)),
+        ('%s_insert' % fts, 'CREATE TRIGGER %s AFTER INSERT ON %s BEGIN %s END' % (
+            quote_name('%s_insert' % fts), table, insert)),
+        ('%s_delete' % fts, 'CREATE TRIGGER %s AFTER DELETE ON %s BEGIN %s END' % (
+            quote_name('%s_delete' % fts), table, delete)),
+        ('%s_update' % fts, 'CREATE TRIGGER %s AFTER UPDATE OF %s ON %s BEGIN %s %s END' % (
+            quote_name('%s_update' % fts), names, table, delete, insert)),
+    ]
+
+
+def ensure_search_indexes(connection):
+    """
+    Create whatever search tables and triggers are missing, e.g. after a
+    migration rebuilt a table (and so dropped its triggers), and rebuild the
+    indexes affected from their tables. Returns the search tables rebuilt.
+    """
+    if not fts5_available(connection):
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')")
+        existing = {name for name, in cursor.fetchall()}
+        rebuilt = []
+        for label, columns in SEARCH_INDEXES.items():
+            model = apps.get_model(label)
+            missing = [sql for name, sql in _index_statements(model, columns, connection) if name not in existing]
+            if not missing:
+                continue
+            fts = connection.ops.quote_name(search_table(model))
+            for sql in missing:
+                cursor.execute(sql)
+            cursor.execute("INSERT INTO %s(%s) VALUES ('rebuild')" % (fts, fts))
+            rebuilt.append(search_table(model))
+    return rebuilt
+
+
+def drop_search_triggers(connection):
+    """
+    Stop keeping the search indexes in step, before a bulk load; rebuilding
+    them afterwards with ensure_search_indexes() is much faster than
+    indexing row by row.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for label in SEARCH_INDEXES:
+            fts = search_table(apps.get_model(label))
+            for action in ('insert', 'delete', 'update'):
+                cursor.execute('DROP TRIGGER IF EXISTS %s' % connection.ops.quote_name('%s_%s' % (fts, action)))
+
+
+def search_index_ready(model, using):
+    """Whether model has a search index on the using database."""
+    if model._meta.label_lower not in SEARCH_INDEXES or connections[using].vendor != 'sqlite':
+        return False
+    key = using, search_table(model)
+    if key not in _ready:
+        with connections[using].cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [key[1]])
+            if cursor.fetchone() is None:
+                return False
+        _ready.add(key)
+    return True
+
+
+def match_expression(search_term):
+    """
+    FTS5 query matching rows that contain every word of search_term, each
+    as a word prefix. Words are quoted, so FTS5 operators typed into the
+    search box are searched for literally.
+    """
+    words = (search_term or '').split()
+    return ' '.join('"%s"*' % word.replace('"', '""') for word in words)
+
+
+def uses_full_text_search(model, search_term):
+    return bool(match_expression(search_term)) and search_index_ready(model, router.db_for_read(model))
+
+
+def full_text_search(queryset, search_term):
+    """
+    queryset narrowed to the rows matching search_term, annotated with
+    search_rank (FTS5's bm25 rank; lower is a better match). None when the
+    model has no search index on the queryset's database.
+    """
+    model = queryset.model
+    match = match_expression(search_term)
+    if not match or not search_index_ready(model, queryset.db):
+        return None
+    quote_name = connections[queryset.db].ops.quote_name
+    fts = quote_name(search_table(model))
+    return queryset.extra(
+        select={'search_rank': '%s.rank' % fts},
+        tables=[search_table(model)],
+        where=['%s.rowid = %s.%s' % (fts, quote_name(model._meta.db_table), quote_name(model._meta.pk.column)),
+               '%s MATCH %%s' % fts],
+        params=[match],
+    )
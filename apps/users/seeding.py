@@ -0,0 +1,95 @@
+"""
+Synthetic data for benchmarks and demos: employees spread over work sites,
+a monthly time sheet per site, a salary entry per employee per month plus
+occasional advances (with history dated as if recorded at the time), and a
+few documents per employee. Everything goes through bulk inserts so large
+datasets seed in seconds to minutes rather than hours.
+"""
+import random
+from datetime import date, datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from apps.users.bulk import bulk_create_with_history, bulk_create_with_keys
+from apps.users.models import (
+    DocumentType, EmployeeBalance, ExpenseTypes, Ledger, TimeSheetMonthlyRecord, User, UserDocument, WorkSite,
+)
+
+TRADES = ('Carpenter', 'Electrician', 'Mason', 'Plumber', 'Painter', 'Steel fixer', 'Welder', 'Helper')
+
+
+def month_starts(years, today=None):
+    """First day of each of the last years * 12 months, oldest first."""
+    month = (today or date.today()).replace(day=1)
+    months = []
+    for _ in range(years * 12):
+        months.append(month)
+        month = (month - timedelta(days=1)).replace(day=1)
+    return months[::-1]
+
+
+def _recorded_at(day):
+    return timezone.make_aware(datetime.combine(day, time(9)), timezone.utc)
+
+
+def seed(employees, sites, years=2, documents=2, advance_rate=0.5, chunk_size=500, random_seed=0):
+    """
+    Add the synthetic dataset and return the number of rows created per
+    model. Runs in one transaction; the same arguments give the same data.
+    """
+    rng = random.Random(random_seed)
+    today = date.today()
+    months = month_starts(years, today)
+    counts = dict.fromkeys(('employees', 'sites', 'time sheets', 'ledger entries', 'documents'), 0)
+
+    with transaction.atomic():
+        first = (User.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+        work_sites = bulk_create_with_keys(
+            [WorkSite(name=f'Site {first + i}', location=f'Location {i % 10}') for i in range(sites)], WorkSite)
+        time_sheets = bulk_create_with_keys(
+            [TimeSheetMonthlyRecord(work_site=site, work_month=month) for site in work_sites for month in months],
+            TimeSheetMonthlyRecord)
+        records = {(record.work_site_id, record.work_month): record for record in time_sheets}
+        counts['sites'], counts['time sheets'] = len(work_sites), len(records)
+
+        for start in range(0, employees, chunk_size):
+            users = bulk_create_with_keys([
+                User(username=f'employee{first + i}', first_name=f'First{first + i}', last_name=f'Last{i % 97}',
+                     password='!', is_staff=False)
+                for i in range(start, min(start + chunk_size, employees))
+            ], User)
+            ledgers, user_documents = [], []
+            for user in users:
+                site = rng.choice(work_sites)
+                trade = rng.choice(TRADES)
+                hourly_rate = round(rng.uniform(8, 40), 2)
+                for month in months:
+                    hours = float(rng.randint(150, 260))
+                    ledgers.append(Ledger(
+                        user=user, type=ExpenseTypes.SALARY.name, expense_date=month, amount=hours * hourly_rate,
+                        hours=hours, hourly_rate=hourly_rate, trade=trade,
+                        time_sheet_record=records[site.pk, month]))
+                    if rng.random() < advance_rate:
+                        ledgers.append(Ledger(
+                            user=user, type=ExpenseTypes.EXPENSE_ADVANCE.name,
+                            expense_date=min(month + timedelta(days=rng.randint(0, 27)), today),
+                            amount=float(rng.randint(1, 20) * 50), notes='Advance'))
+                for _ in range(documents):
+                    document_type = rng.choice(list(DocumentType))
+                    user_documents.append(UserDocument(
+                        user=user, document_type=document_type.value, name=f'{document_type.value} {user.pk}',
+                        issued_date=months[0], expiry_date=today + timedelta(days=rng.randint(-365, 730))))
+            now = timezone.now()
+            for ledger in ledgers:
+                # Entries dated today were recorded no later than now.
+                ledger._history_date = min(_recorded_at(ledger.expense_date), now)
+            bulk_create_with_history(ledgers, Ledger)
+            bulk_create_with_keys(user_documents, UserDocument)
+            counts['employees'] += len(users)
+            counts['ledger entries'] += len(ledgers)
+            counts['documents'] += len(user_documents)
+
+        EmployeeBalance.rebuild()
+    return counts
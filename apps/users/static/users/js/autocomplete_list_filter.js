@@ -0,0 +1,16 @@
+(function($) {
+    'use strict';
+    // Reload the changelist filtered by the picked value, keeping the other filters.
+    $(function() {
+        $('.autocomplete-list-filter').on('change', function() {
+            var $select = $(this);
+            var url = $select.data('clear-url');
+            var value = $select.val();
+            if (value) {
+                url += (url === '?' ? '' : '&') + encodeURIComponent($select.data('parameter')) + '=' +
+                    encodeURIComponent(value);
+            }
+            window.location.href = url;
+        });
+    });
+}(django.jQuery));
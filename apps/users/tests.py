@@ -0,0 +1,127 @@
+import datetime
+import unittest
+
+from django.contrib import admin
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Sum
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from apps.users.models import EmployeeBalance, ExpenseTypes, Ledger, User
+from apps.users.seeding import seed
+
+TEST_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests'}}
+
+# Most queries a changelist may run on a cold cache, keyed by model label.
+# They include the session and user lookups of the request and must not
+# grow with the number of rows on the page.
+CHANGELIST_QUERY_BUDGETS = {
+    'users.user': 6,
+    'users.userdocument': 6,
+    'users.worksite': 5,
+    'users.timesheetmonthlyrecord': 5,
+    'users.ledger': 5,
+}
+DEFAULT_CHANGELIST_QUERY_BUDGET = 6
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ChangelistQueriesTestCase(TestCase):
+    """
+    Loads admin changelists as a superuser and counts their queries. The
+    cache is cleared before each load, so cached counts and totals don't
+    hide queries.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.superuser = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.superuser)
+
+    def changelist_queries(self, model, **params):
+        """The queries run by a GET of model's changelist with params."""
+        cache.clear()
+        url = reverse('admin:%s_%s_changelist' % (model._meta.app_label, model._meta.model_name))
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, url)
+        return context.captured_queries
+
+    def assertChangelistWithinBudget(self, model, budget=None, **params):
+        if budget is None:
+            budget = CHANGELIST_QUERY_BUDGETS.get(model._meta.label_lower, DEFAULT_CHANGELIST_QUERY_BUDGET)
+        queries = self.changelist_queries(model, **params)
+        self.assertLessEqual(len(queries), budget, '%s changelist ran %d queries:\n%s' % (
+            model._meta.label, len(queries), '\n'.join(query['sql'] for query in queries)))
+
+
+class ChangelistQueryBudgetTests(ChangelistQueriesTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        seed(30, 3, years=1)
+
+    def test_registered_changelists_within_budget(self):
+        for model in admin.site._registry:
+            with self.subTest(model=model._meta.label):
+                self.assertChangelistWithinBudget(model)
+
+
+class EmployeeChangelistQueryTests(ChangelistQueriesTestCase):
+
+    def test_query_count_independent_of_page_size(self):
+        seed(5, 1, years=1)
+        few = len(self.changelist_queries(User))
+        seed(45, 1, years=1)
+        self.assertEqual(User.objects.count(), 51)
+        self.assertEqual(len(self.changelist_queries(User)), few)
+
+
+def is_full_scan(step, limited=False):
+    # "SCAN users_ledger" (or "SCAN TABLE users_ledger" on older SQLite)
+    # reads every row of the table. Walking an index in order ("SCAN ...
+    # USING [COVERING] INDEX") only stops early under a LIMIT.
+    return step.startswith('SCAN') and not (limited and 'INDEX' in step)
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'Query plans are only checked on SQLite.')
+class LedgerQueryPlanTests(TestCase):
+    """The main Ledger queries must be answered from an index, never by reading the whole table."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed(20, 2, years=1)
+        cls.user_id = User.objects.order_by('pk').values_list('pk', flat=True).first()
+
+    def get_querysets(self):
+        user_id = self.user_id
+        month = datetime.date.today().replace(day=1)
+        yield 'user total', Ledger.objects.filter(
+            user_id=user_id, type=ExpenseTypes.SALARY.name
+        ).values('user').annotate(total=Sum('amount')).order_by('user')
+        yield 'balance recompute', Ledger.objects.filter(
+            user_id__in=[user_id]).values('user_id', 'type').annotate(total=Sum('amount')).order_by()
+        yield 'changelist page', Ledger.objects.order_by('-expense_date', 'user', 'type', 'id')[:100]
+        yield 'employee changelist page', Ledger.objects.filter(
+            user_id=user_id).order_by('-expense_date', 'user', 'type', 'id')[:100]
+        yield 'date filter', Ledger.objects.filter(
+            expense_date__gte=month).order_by('-expense_date', 'user', 'type', 'id')[:100]
+        yield 'type and date filter', Ledger.objects.filter(
+            type=ExpenseTypes.SALARY.name, expense_date__gte=month).order_by('-expense_date', 'user', 'type', 'id')[:100]
+        yield 'employee balance', EmployeeBalance.objects.filter(user_id=user_id)
+
+    def test_no_full_table_scans(self):
+        for label, queryset in self.get_querysets():
+            with self.subTest(query=label):
+                sql, params = queryset.query.sql_with_params()
+                with connection.cursor() as cursor:
+                    cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+                    plan = [row[-1] for row in cursor.fetchall()]
+                limited = queryset.query.high_mark is not None
+                self.assertFalse([step for step in plan if is_full_scan(step, limited)], '\n'.join(plan))
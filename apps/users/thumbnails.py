@@ -0,0 +1,87 @@
+"""
+Small JPEG variants of uploaded images for the admin changelists.
+
+Thumbnails live under MEDIA_ROOT/thumbs, keyed by the stored name of the
+source file, and are rendered in a process pool so neither uploads nor page
+loads wait for Pillow. Until a thumbnail exists the original URL is used.
+"""
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_DIR = 'thumbs'
+THUMBNAIL_SIZE = (100, 100)
+
+_executor = None
+_pending = set()
+_failed = set()
+
+
+def thumbnail_name(name, size=THUMBNAIL_SIZE):
+    return '%s/%s_%dx%d.jpg' % (THUMBNAIL_DIR, name, size[0], size[1])
+
+
+def render_thumbnail(source_path, target_path, size=THUMBNAIL_SIZE):
+    """Write a JPEG thumbnail of source_path to target_path. Runs in the worker processes."""
+    with Image.open(source_path) as image:
+        image.thumbnail(size)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        partial_path = f'{target_path}.{os.getpid()}.tmp'
+        image.save(partial_path, 'JPEG', quality=85)
+    os.replace(partial_path, target_path)
+    return target_path
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=settings.THUMBNAIL_WORKERS)
+    return _executor
+
+
+def _done(target, future):
+    _pending.discard(target)
+    if future.exception() is not None:
+        _failed.add(target)
+        logger.warning('Could not render %s: %s', target, future.exception())
+
+
+def schedule_thumbnail(name, size=THUMBNAIL_SIZE, storage=default_storage):
+    """Render the thumbnail of the stored file name in the background, unless it exists or is underway."""
+    target = thumbnail_name(name, size)
+    if Image is None or not name or target in _pending or target in _failed or storage.exists(target):
+        return
+    args = (storage.path(name), storage.path(target), size)
+    if not settings.THUMBNAIL_WORKERS:
+        try:
+            render_thumbnail(*args)
+        except Exception as e:
+            _failed.add(target)
+            logger.warning('Could not make a thumbnail of %s: %s', name, e)
+        return
+    _pending.add(target)
+    future = _get_executor().submit(render_thumbnail, *args)
+    future.add_done_callback(lambda future: _done(target, future))
+
+
+def thumbnail_url(file, size=THUMBNAIL_SIZE):
+    """URL of the thumbnail of a FieldFile, or of the file itself until the thumbnail is ready."""
+    if not file:
+        return ''
+    target = thumbnail_name(file.name, size)
+    if file.storage.exists(target):
+        return file.storage.url(target)
+    schedule_thumbnail(file.name, size, file.storage)
+    return file.url
@@ -0,0 +1,173 @@
+import csv
+import io
+import math
+import os
+
+from django.db import transaction
+
+from apps.users.bulk import bulk_create_with_history
+from apps.users.models import EmployeeBalance, ExpenseTypes, Ledger, User, invalidate_monthly_reports
+
+EMPLOYEE_COLUMN = 'employee'
+REQUIRED_COLUMNS = (EMPLOYEE_COLUMN, 'hours', 'hourly_rate', 'trade')
+MAX_REPORTED_ERRORS = 20
+
+
+class TimeSheetImportError(Exception):
+    def __init__(self, errors):
+        self.errors = errors
+        shown = errors[:MAX_REPORTED_ERRORS]
+        if len(errors) > len(shown):
+            shown.append(f'... and {len(errors) - len(shown)} more')
+        super().__init__('; '.join(shown))
+
+
+def _normalize_header(header):
+    return [str(column or '').strip().lower().replace(' ', '_') for column in header]
+
+
+def _read_csv(file):
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    try:
+        reader = csv.reader(text)
+        header = _normalize_header(next(reader, []))
+        yield header
+        for row in reader:
+            yield row
+    finally:
+        # Leave the underlying file open for the caller.
+        text.detach()
+
+
+def _read_xlsx(file):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise TimeSheetImportError(['Importing .xlsx time sheets requires openpyxl.'])
+
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        yield _normalize_header(next(rows, ()))
+        for row in rows:
+            yield row
+    finally:
+        workbook.close()
+
+
+def iter_time_sheet_rows(file):
+    """Yield (line number, {column: value}) for each non-empty row of a CSV or XLSX time sheet."""
+    extension = os.path.splitext(file.name)[1].lower()
+    rows = _read_xlsx(file) if extension == '.xlsx' else _read_csv(file)
+
+    try:
+        header = next(rows)
+        missing = [column for column in REQUIRED_COLUMNS if column not in header]
+        if missing:
+            raise TimeSheetImportError([f"Missing column(s): {', '.join(missing)}"])
+
+        for line_no, row in enumerate(rows, start=2):
+            if not any(value not in (None, '') for value in row):
+                continue
+            yield line_no, dict(zip(header, row))
+    finally:
+        # Finish the reader, which detaches from the file, while the file is still open.
+        rows.close()
+
+
+def build_employee_lookup():
+    """Map lower-cased usernames and string ids to user ids, in one query."""
+    lookup = {}
+    for user_id, username in User.objects.values_list('id', 'username').iterator():
+        lookup[username.lower()] = user_id
+        lookup[str(user_id)] = user_id
+    return lookup
+
+
+def _parse_number(value, column):
+    if value in (None, ''):
+        raise ValueError(f'{column} is missing')
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{column} "{value}" is not a number')
+    if not math.isfinite(number):
+        raise ValueError(f'{column} "{value}" is not a finite number')
+    if number < 0:
+        raise ValueError(f'{column} must not be negative')
+    return number
+
+
+def _employee_key(value):
+    if isinstance(value, float) and value.is_integer():
+        # Spreadsheets hand numeric ids back as floats.
+        value = int(value)
+    return str(value or '').strip().lower()
+
+
+def import_time_sheet(record, history_user=None, batch_size=500):
+    """
+    Create a SALARY Ledger row for every worker in record's time sheet file.
+
+    The file is streamed row by row and written in batches. Any invalid row
+    rolls the whole import back and raises TimeSheetImportError listing the
+    problems. Returns the number of ledger rows created.
+    """
+    if record.ledger_set.filter(type=ExpenseTypes.SALARY.name).exists():
+        raise TimeSheetImportError([f'{record} already has salary entries.'])
+
+    employees = build_employee_lookup()
+    errors = []
+    user_ids = set()
+    created = 0
+    batch = []
+
+    def flush():
+        nonlocal created
+        if batch and not errors:
+            bulk_create_with_history(batch, Ledger, batch_size=batch_size, history_user=history_user)
+            created += len(batch)
+        batch.clear()
+
+    record.time_sheet_file.open('rb')
+    rows = iter_time_sheet_rows(record.time_sheet_file)
+    try:
+        with transaction.atomic():
+            for line_no, row in rows:
+                # Rows shorter than the header lack their last columns.
+                try:
+                    if row.get(EMPLOYEE_COLUMN) in (None, ''):
+                        raise ValueError(f'{EMPLOYEE_COLUMN} is missing')
+                    user_id = employees.get(_employee_key(row[EMPLOYEE_COLUMN]))
+                    if user_id is None:
+                        raise ValueError(f'unknown employee "{row[EMPLOYEE_COLUMN]}"')
+                    hours = _parse_number(row.get('hours'), 'hours')
+                    hourly_rate = _parse_number(row.get('hourly_rate'), 'hourly_rate')
+                except ValueError as e:
+                    errors.append(f'Row {line_no}: {e}')
+                    continue
+
+                user_ids.add(user_id)
+                batch.append(Ledger(
+                    user_id=user_id,
+                    type=ExpenseTypes.SALARY.name,
+                    expense_date=record.work_month,
+                    amount=hours * hourly_rate,
+                    notes=row.get('notes') or None,
+                    time_sheet_record=record,
+                    hours=hours,
+                    hourly_rate=hourly_rate,
+                    trade=str(row['trade']).strip() if row.get('trade') is not None else None,
+                ))
+                if len(batch) >= batch_size:
+                    flush()
+            flush()
+
+            if errors:
+                raise TimeSheetImportError(errors)
+            EmployeeBalance.refresh_for_users(user_ids)
+            invalidate_monthly_reports([record.work_month])
+    finally:
+        rows.close()
+        record.time_sheet_file.close()
+    return created
@@ -0,0 +1,181 @@
+"""
+Streaming JSONL dump and load of the users app, for moving data between
+environments without dumpdata/loaddata building the whole object graph and
+saving (and recording history) row by row.
+
+Each line is {"model": "<app_label.model_name>", "fields": {<column>: value}}.
+Models are written in dependency order, so a load can insert them in file
+order, a batch at a time and without any save signals. Rows go in through
+one prepared INSERT per model and executemany(): faster than bulk_create's
+statement building, and auto_now timestamps keep their dumped values.
+Employees' permissions and groups travel by natural key
+("app_label.codename" and group name), since their ids differ between
+databases. EmployeeBalance is derived data and is rebuilt after a load
+instead of being dumped.
+"""
+import datetime
+import json
+from itertools import groupby
+
+from django.contrib.auth.models import Group, Permission
+from django.core.management.color import no_style
+from django.db import connection, transaction
+
+from apps.users.caching import bump_version
+from apps.users.models import (
+    EmployeeBalance, Ledger, LedgerHistoryArchive, TimeSheetMonthlyRecord, User, UserDocument, WorkSite,
+)
+from apps.users.search import drop_search_triggers, ensure_search_indexes
+
+MODELS = (User, WorkSite, UserDocument, TimeSheetMonthlyRecord, Ledger, Ledger.history.model, LedgerHistoryArchive)
+USER_PERMISSIONS = 'users.user_permissions'
+USER_GROUPS = 'users.user_groups'
+# Field types that JSON can't carry natively; dumped as strings, parsed on load.
+PARSED_TYPES = {'DateField', 'DateTimeField', 'TimeField', 'DecimalField', 'DurationField', 'UUIDField'}
+
+
+class LoadError(Exception):
+    pass
+
+
+def _to_json(value):
+    # Full precision, unlike DjangoJSONEncoder's millisecond datetimes.
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        return str(value.total_seconds())
+    return str(value)
+
+
+def _line(label, fields):
+    return json.dumps({'model': label, 'fields': fields}) + '\n'
+
+
+def dump(stream, chunk_size=5000):
+    """Write every row of MODELS to stream as JSONL; returns {label: rows}."""
+    counts = {}
+    for model in MODELS:
+        label = model._meta.label_lower
+        fields = model._meta.concrete_fields
+        columns = [field.attname for field in fields]
+        parsed = [i for i, field in enumerate(fields) if field.get_internal_type() in PARSED_TYPES]
+        rows = model._default_manager.order_by('pk').values_list(*columns)
+        counts[label] = 0
+        for row in rows.iterator(chunk_size=chunk_size):
+            values = dict(zip(columns, row))
+            for i in parsed:
+                if row[i] is not None:
+                    values[columns[i]] = _to_json(row[i])
+            stream.write(_line(label, values))
+            counts[label] += 1
+
+    permissions = User.user_permissions.through.objects.order_by('pk').values_list(
+        'user_id', 'permission__content_type__app_label', 'permission__codename')
+    counts[USER_PERMISSIONS] = 0
+    for user_id, app_label, codename in permissions.iterator(chunk_size=chunk_size):
+        stream.write(_line(USER_PERMISSIONS, {'user_id': user_id, 'permission': f'{app_label}.{codename}'}))
+        counts[USER_PERMISSIONS] += 1
+    groups = User.groups.through.objects.order_by('pk').values_list('user_id', 'group__name')
+    counts[USER_GROUPS] = 0
+    for user_id, name in groups.iterator(chunk_size=chunk_size):
+        stream.write(_line(USER_GROUPS, {'user_id': user_id, 'group': name}))
+        counts[USER_GROUPS] += 1
+    return counts
+
+
+def _permission_ids():
+    return {f'{app_label}.{codename}': pk for pk, app_label, codename in
+            Permission.objects.values_list('pk', 'content_type__app_label', 'codename')}
+
+
+def load(stream, batch_size=5000):
+    """
+    Insert the rows of a dump into empty tables, in one transaction, then
+    reset the sequences and rebuild EmployeeBalance and the search indexes.
+    Returns {label: rows}.
+    """
+    models = {model._meta.label_lower: model for model in MODELS}
+    non_empty = [label for label, model in models.items() if model._default_manager.exists()]
+    if non_empty:
+        raise LoadError(f"Load into empty tables only; {', '.join(non_empty)} already have rows.")
+
+    records = (json.loads(line) for line in stream if line.strip())
+    counts = {}
+    with transaction.atomic():
+        drop_search_triggers(connection)
+        for label, group in groupby(records, key=lambda record: record['model']):
+            if label == USER_PERMISSIONS:
+                loaded = _load_permissions(group, batch_size)
+            elif label == USER_GROUPS:
+                loaded = _load_groups(group, batch_size)
+            elif label in models:
+                loaded = _load_rows(models[label], group, batch_size)
+            else:
+                raise LoadError(f'Unknown model {label!r} in the dump.')
+            counts[label] = counts.get(label, 0) + loaded
+
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), MODELS):
+                cursor.execute(sql)
+        EmployeeBalance.rebuild()
+        ensure_search_indexes(connection)
+    bump_version('documents')
+    return counts
+
+
+def _converter(field):
+    if field.get_internal_type() not in PARSED_TYPES:
+        return None
+    return lambda value: field.get_db_prep_save(field.to_python(value), connection)
+
+
+def _load_rows(model, records, batch_size):
+    fields = model._meta.concrete_fields
+    converters = [(i, _converter(field)) for i, field in enumerate(fields) if _converter(field)]
+    defaults = {field.attname: field.get_default() for field in fields}
+    quote_name = connection.ops.quote_name
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+        quote_name(model._meta.db_table), ', '.join(quote_name(field.column) for field in fields),
+        ', '.join(['%s'] * len(fields)))
+
+    loaded, batch = 0, []
+    with connection.cursor() as cursor:
+        for record in records:
+            values = record['fields']
+            row = [values[attname] if attname in values else default for attname, default in defaults.items()]
+            for i, convert in converters:
+                if row[i] is not None:
+                    row[i] = convert(row[i])
+            batch.append(row)
+            if len(batch) >= batch_size:
+                cursor.executemany(sql, batch)
+                loaded, batch = loaded + len(batch), []
+        if batch:
+            cursor.executemany(sql, batch)
+    return loaded + len(batch)
+
+
+def _load_permissions(records, batch_size):
+    through = User.user_permissions.through
+    permission_ids = _permission_ids()
+    rows = []
+    for record in records:
+        permission_id = permission_ids.get(record['fields']['permission'])
+        if permission_id is None:
+            raise LoadError(f"Unknown permission {record['fields']['permission']!r}; run migrate first.")
+        rows.append(through(user_id=record['fields']['user_id'], permission_id=permission_id))
+    through.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
+
+
+def _load_groups(records, batch_size):
+    through = User.groups.through
+    group_ids = dict(Group.objects.values_list('name', 'pk'))
+    rows = []
+    for record in records:
+        name = record['fields']['group']
+        if name not in group_ids:
+            group_ids[name] = Group.objects.create(name=name).pk
+        rows.append(through(user_id=record['fields']['user_id'], group_id=group_ids[name]))
+    through.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
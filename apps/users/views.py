@@ -0,0 +1,161 @@
+import mimetypes
+import os
+import posixpath
+import re
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.files.storage import default_storage
+from django.core.exceptions import PermissionDenied
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_safe
+
+from apps.users.caching import cache_stats, reset_cache_stats
+from apps.users.models import TimeSheetMonthlyRecord, UserDocument
+from apps.users.profiling import request_stats, reset_stats
+from apps.users.thumbnails import THUMBNAIL_DIR
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+THUMBNAIL_RE = re.compile(r'^%s/(?P<name>.+)_\d+x\d+\.jpg$' % THUMBNAIL_DIR)
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+class MediaFileResponse(FileResponse):
+    block_size = 64 * 1024
+
+
+class FileRange:
+    """Read-only view of length bytes of file starting at start."""
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def can_view_media(user, name):
+    """
+    Mirror the admin: superusers see every file, other staff only their own
+    profile picture and documents, plus the time sheets they can list.
+    Thumbnails follow the file they were made from.
+    """
+    if user.is_superuser:
+        return True
+    match = THUMBNAIL_RE.match(name)
+    if match:
+        name = match.group('name')
+    return (name == user.profile_pic.name or
+            UserDocument.objects.filter(user=user, image=name).exists() or
+            TimeSheetMonthlyRecord.objects.filter(time_sheet_file=name).exists())
+
+
+def parse_range(header, size):
+    """Return (start, end) for a single "bytes=" range, None to send the whole file, or raise ValueError."""
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    else:
+        start, end = max(size - int(last), 0), size - 1
+    if start > end or start >= size:
+        raise ValueError(header)
+    return start, end
+
+
+@require_safe
+@staff_member_required
+def serve_media(request, path):
+    name = posixpath.normpath(path).lstrip('/')
+    if name.startswith('..') or not can_view_media(request.user, name):
+        raise Http404
+    try:
+        full_path = default_storage.path(name)
+        stat = os.stat(full_path)
+    except (OSError, ValueError):
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+
+    etag = quote_etag('%x-%x' % (stat.st_size, int(stat.st_mtime)))
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        response = _file_response(request, name, full_path, stat.st_size, etag)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    if name.startswith(tuple(settings.MEDIA_IMMUTABLE_PREFIXES)):
+        patch_cache_control(response, private=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def _file_response(request, name, full_path, size, etag):
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+
+    if settings.MEDIA_ACCEL_REDIRECT:
+        # Let the front-end server send the file (and handle ranges) itself.
+        response = HttpResponse(content_type=content_type)
+        if settings.MEDIA_ACCEL_REDIRECT == 'x-accel-redirect':
+            response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX + name
+        else:
+            response['X-Sendfile'] = full_path
+        return response
+
+    start, end = 0, size - 1
+    byte_range = request.META.get('HTTP_RANGE')
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if byte_range and (not if_range or if_range == etag):
+        try:
+            byte_range = parse_range(byte_range, size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%d' % size
+            return response
+        if byte_range:
+            start, end = byte_range
+
+    file = open(full_path, 'rb')
+    if (start, end) == (0, size - 1):
+        response = MediaFileResponse(file, content_type=content_type)
+    else:
+        response = MediaFileResponse(FileRange(file, start, end - start + 1), content_type=content_type, status=206)
+        response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+    response['Content-Length'] = end - start + 1
+    response['Accept-Ranges'] = 'bytes'
+    if encoding:
+        response['Content-Encoding'] = encoding
+    return response
+
+
+@staff_member_required
+def profiling_stats(request):
+    """
+    Per URL pattern request statistics collected by RequestProfilingMiddleware
+    and this process's cache hits and misses; POST resets them.
+    """
+    if not request.user.is_superuser:
+        raise PermissionDenied
+    if request.method == 'POST':
+        reset_stats()
+        reset_cache_stats()
+    return JsonResponse({
+        'enabled': settings.REQUEST_PROFILING,
+        'requests': request_stats(),
+        'cache': cache_stats(),
+    }, json_dumps_params={'indent': 2})
@@ -0,0 +1,35 @@
+"""
+SQLite backend with two OPTIONS that later Django versions provide:
+
+- init_command: statements, separated by ";", run on every new connection;
+  used for the PRAGMAs that aren't stored in the database file.
+- transaction_mode: "DEFERRED", "IMMEDIATE" or "EXCLUSIVE" for BEGIN.
+  IMMEDIATE takes the write lock up front, so concurrent writers wait out
+  the busy timeout instead of failing with "database is locked" when a
+  read transaction can't be upgraded.
+"""
+from django.db.backends.sqlite3 import base
+
+CUSTOM_OPTIONS = ('init_command', 'transaction_mode')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        for option in CUSTOM_OPTIONS:
+            kwargs.pop(option, None)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        init_command = self.settings_dict['OPTIONS'].get('init_command')
+        if init_command:
+            for statement in init_command.split(';'):
+                if statement.strip():
+                    conn.execute(statement)
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        transaction_mode = self.settings_dict['OPTIONS'].get('transaction_mode')
+        self.cursor().execute(f'BEGIN {transaction_mode}' if transaction_mode else 'BEGIN')
@@ -27,6 +27,25 @@ AUTH_USER_MODEL = 'users.User'
 # Rest of the settings
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Uploads are stored once per distinct content, named by their SHA-256.
+DEFAULT_FILE_STORAGE = 'apps.users.storage.ContentAddressedStorage'
+
+# Media files are served by apps.users.views.serve_media, which checks who
+# may see them. Set MEDIA_ACCEL_REDIRECT to 'x-accel-redirect' (nginx, with an
+# internal location at MEDIA_ACCEL_PREFIX) or 'x-sendfile' (Apache) to let the
+# web server send the file once Django has allowed it.
+MEDIA_ACCEL_REDIRECT = None
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+# Names under these prefixes never change content and are cached for a year.
+MEDIA_IMMUTABLE_PREFIXES = ('blobs/', 'thumbs/')
+
+# Processes rendering profile picture and document thumbnails; 0 renders
+# them inline instead.
+THUMBNAIL_WORKERS = 2
+
+# compact_ledger_history keeps every ledger version recorded in this many
+# days, and only the last earlier version of each entry.
+LEDGER_HISTORY_RETENTION_DAYS = 2 * 365
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/2.2/howto/deployment/checklist/
@@ -62,9 +81,16 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'simple_history.middleware.HistoryRequestMiddleware'
+    'simple_history.middleware.HistoryRequestMiddleware',
+    'apps.users.profiling.RequestProfilingMiddleware',
 ]
 
+# Per URL pattern wall time and SQL statistics, served at /profiling/ to
+# superusers. Requests slower than REQUEST_PROFILING_SLOW_MS are logged with
+# their repeated queries.
+REQUEST_PROFILING = False
+REQUEST_PROFILING_SLOW_MS = 500
+
 ROOT_URLCONF = 'ems.urls'
 
 TEMPLATES = [
@@ -90,10 +116,58 @@ WSGI_APPLICATION = 'ems.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
-DATABASES = {
+# Set EMS_DB_ENGINE=postgresql (needs psycopg2) and EMS_DB_NAME, EMS_DB_USER,
+# EMS_DB_PASSWORD, EMS_DB_HOST, EMS_DB_PORT to use PostgreSQL. Otherwise
+# SQLite at EMS_DB_NAME, tuned for several concurrent writers: WAL lets
+# readers carry on during a write, and writers queue on the write lock for
+# up to EMS_DB_TIMEOUT seconds instead of failing with "database is locked".
+# EMS_DB_CONN_MAX_AGE keeps connections open across requests (seconds;
+# 0 closes them after every request).
+
+DB_ENGINE = os.environ.get('EMS_DB_ENGINE', 'sqlite3')
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('EMS_DB_NAME', 'ems'),
+            'USER': os.environ.get('EMS_DB_USER', ''),
+            'PASSWORD': os.environ.get('EMS_DB_PASSWORD', ''),
+            'HOST': os.environ.get('EMS_DB_HOST', ''),
+            'PORT': os.environ.get('EMS_DB_PORT', ''),
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'ems.db.sqlite3',
+            'NAME': os.environ.get('EMS_DB_NAME', os.path.join(BASE_DIR, 'db.sqlite3')),
+            'OPTIONS': {
+                'timeout': int(os.environ.get('EMS_DB_TIMEOUT', 20)),
+                'transaction_mode': 'IMMEDIATE',
+                'init_command': (
+                    'PRAGMA journal_mode = WAL;'
+                    'PRAGMA synchronous = NORMAL;'
+                    'PRAGMA mmap_size = 268435456;'  # 256 MiB
+                    'PRAGMA cache_size = -65536;'  # 64 MiB
+                    'PRAGMA temp_store = MEMORY'
+                ),
+            },
+        }
+    }
+
+DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('EMS_DB_CONN_MAX_AGE', 60))
+
+
+# There is no cache service; a file-based cache is shared by every worker
+# process, so an invalidation made by one is seen by the others.
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
     }
 }
 